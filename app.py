@@ -1,13 +1,29 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-import pandas as pd
+# pandas/numpy are imported where uploads are read, so the server starts without them
 import os
 from werkzeug.utils import secure_filename
 import json
+import base64
+import bisect
+import sys
+import io
+import mmap
+import struct
+import tempfile
+import uuid
+import hashlib
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import re
-from dateutil.rrule import rrule, WEEKLY, DAILY, MO, TU, WE, TH, FR, SA, SU
+from dateutil.rrule import MO, TU, WE, TH, FR, SA, SU
 from dateutil.parser import parse as date_parse
 from flask_sqlalchemy import SQLAlchemy
+from script import parse_timetable_rows
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-in-production'
@@ -15,10 +31,28 @@ app.secret_key = 'your-secret-key-here-change-in-production'
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'csv'}
+TIMETABLE_EXTENSIONS = {'csv', 'xlsx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///timetable.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['EVENTS_CACHE_MAX_ENTRIES'] = 256
+app.config['EVENTS_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['INGEST_CHUNK_ROWS'] = 20000
+app.config['INGEST_WORKERS'] = 2
+app.config['INGEST_JOBS_KEPT'] = 50
+# Seconds between checks for a timetable published by another worker
+app.config['TIMETABLE_REFRESH_INTERVAL'] = 1.0
+# Compiled timetable shared read-only by all workers through mmap
+app.config['TIMETABLE_SNAPSHOT_FILE'] = os.path.join(app.instance_path, 'timetable.snapshot')
+# Last uploaded teachers list, restored on startup
+app.config['TEACHERS_FILE'] = os.path.join(app.instance_path, 'teachers.json')
+# Substitute planning costs: lower is better
+app.config['SUBSTITUTE_SUBJECT_MISMATCH_COST'] = 100
+app.config['SUBSTITUTE_UNFAMILIAR_CLASS_COST'] = 30
+app.config['SUBSTITUTE_DAILY_LOAD_COST'] = 20    # per cover already given that day
+app.config['SUBSTITUTE_HISTORY_LOAD_COST'] = 1   # per past substitution, capped below
+app.config['SUBSTITUTE_HISTORY_LOAD_CAP'] = 50
 
 # Ensure upload folder exists
 if not os.path.exists(UPLOAD_FOLDER):
@@ -26,7 +60,6 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 # Global variables to store data
 teachers_data = []
-timetable_data = []
 
 # Day mapping for RRULE
 DAY_MAPPING = {
@@ -38,11 +71,18 @@ DAY_MAPPING = {
     'saturday': SA, 'sat': SA,
     'sunday': SU, 'sun': SU
 }
+WEEKDAY_CODES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
 
 db = SQLAlchemy(app)
 
 class TimetableEntry(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    """Persisted timetable row; id is the row's stable id in CompiledTimetable"""
+    __table_args__ = (
+        db.Index('ix_timetable_entry_day_period', 'day', 'period'),
+        db.Index('ix_timetable_entry_teacher_name', 'teacher_name'),
+        db.Index('ix_timetable_entry_class_activity', 'class_activity'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
     teacher_name = db.Column(db.String(100), nullable=False)
     subject = db.Column(db.String(100), nullable=False)
     day = db.Column(db.String(20), nullable=False)
@@ -50,27 +90,198 @@ class TimetableEntry(db.Model):
     time_slot = db.Column(db.String(50), nullable=False)
     class_activity = db.Column(db.String(100), nullable=False)
 
+class TimetableState(db.Model):
+    """Single row holding the version of the timetable stored in timetable_entry"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Next stable row id, so ids of removed rows are never handed out again
+    next_row_id = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped with every saved substitution, so all workers drop overlaid event payloads
+    substitution_version = db.Column(db.Integer, nullable=False, default=0)
+
+class IngestJob(db.Model):
+    """Status of a background timetable upload, readable from any worker"""
+    id = db.Column(db.String(12), primary_key=True)
+    submitted_at = db.Column(db.DateTime, nullable=False, index=True)
+    state = db.Column(db.Text, nullable=False)  # the job dict as JSON
+
 class Substitution(db.Model):
+    __table_args__ = (
+        db.Index('ix_substitution_date_period', 'date', 'period'),
+        db.Index('ix_substitution_original_teacher', 'original_teacher', 'date'),
+        db.Index('ix_substitution_substitute_teacher', 'substitute_teacher', 'date'),
+        # A teacher can only cover one lesson per period, even under concurrent saves
+        db.Index('ux_substitution_substitute_slot', 'date', 'period', 'substitute_key', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(20), nullable=False)
-    period = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    period = db.Column(db.Integer, nullable=False)
     class_activity = db.Column(db.String(100), nullable=False)
     original_teacher = db.Column(db.String(100), nullable=False)
     substitute_teacher = db.Column(db.String(100), nullable=False)
+    substitute_key = db.Column(db.String(100), nullable=False, default='')  # teacher_key(substitute_teacher)
     subject = db.Column(db.String(100), nullable=False)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    @db.validates('substitute_teacher')
+    def _set_substitute_key(self, field, value):
+        self.substitute_key = teacher_key(value)
+        return value
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'period': self.period,
+            'class_activity': self.class_activity,
+            'original_teacher': self.original_teacher,
+            'substitute_teacher': self.substitute_teacher,
+            'subject': self.subject
+        }
+
+class TeacherSubstitutionStats(db.Model):
+    """Running absence/substitution counts per normalized teacher name"""
+    teacher_key = db.Column(db.String(100), primary_key=True)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    substitute = db.Column(db.Integer, nullable=False, default=0)
+
+def teacher_key(name):
+    """Normalized teacher name used to match substitutions to the timetable"""
+    return (name or '').strip().lower()
+
+def record_substitution_stats(pairs):
+    """Add (original_teacher, substitute_teacher) pairs to the counters in the current session.
+
+    Increments are applied as SQL expressions, so concurrent requests don't
+    lose updates. The caller commits together with the substitutions.
+    """
+    deltas = {}
+    for original, substitute in pairs:
+        deltas.setdefault(teacher_key(original), [0, 0])[0] += 1
+        deltas.setdefault(teacher_key(substitute), [0, 0])[1] += 1
+    for key, (absent, substitute) in deltas.items():
+        stats = db.session.get(TeacherSubstitutionStats, key)
+        if stats is None:
+            db.session.add(TeacherSubstitutionStats(teacher_key=key, absent=absent, substitute=substitute))
+        else:
+            stats.absent = TeacherSubstitutionStats.absent + absent
+            stats.substitute = TeacherSubstitutionStats.substitute + substitute
+
+def rebuild_substitution_stats():
+    """Recount the counters table from the substitutions with GROUP BY queries"""
+    counts = {}
+    for column, slot in ((Substitution.original_teacher, 0), (Substitution.substitute_teacher, 1)):
+        for name, count in db.session.query(column, db.func.count()).group_by(column):
+            counts.setdefault(teacher_key(name), [0, 0])[slot] += count
+    TeacherSubstitutionStats.query.delete()
+    db.session.add_all(TeacherSubstitutionStats(teacher_key=key, absent=absent, substitute=substitute)
+                       for key, (absent, substitute) in counts.items())
+    db.session.commit()
+
+def get_teacher_stats(teachers):
+    """{teacher: {'absent': n, 'substitute': n}} for the given timetable teachers"""
+    keys = {teacher: teacher_key(teacher) for teacher in teachers}
+    rows = TeacherSubstitutionStats.query.filter(
+        TeacherSubstitutionStats.teacher_key.in_(set(keys.values()))
+    ).all()
+    counts = {row.teacher_key: row for row in rows}
+    teacher_stats = {}
+    for teacher, key in keys.items():
+        row = counts.get(key)
+        teacher_stats[teacher] = {'absent': row.absent if row else 0, 'substitute': row.substitute if row else 0}
+    return teacher_stats
+
+def migrate_substitution_table():
+    """Convert a substitution table with string date/period columns to the typed, indexed schema"""
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table('substitution'):
+        return
+    column_types = {column['name']: column['type'] for column in inspector.get_columns('substitution')}
+    if isinstance(column_types['date'], db.Date):
+        return
+    with db.engine.begin() as connection:
+        connection.execute(db.text('ALTER TABLE substitution RENAME TO substitution_legacy'))
+        Substitution.__table__.create(connection)
+        legacy = connection.execute(db.text(
+            'SELECT id, date, period, class_activity, original_teacher, substitute_teacher, subject '
+            'FROM substitution_legacy'
+        ))
+        rows = []
+        slots = set()
+        skipped = 0
+        for row in legacy.mappings():
+            row = dict(row)
+            try:
+                row['date'] = date_parse(row['date']).date()
+                row['period'] = int(row['period'])
+            except (ValueError, TypeError, OverflowError):
+                skipped += 1
+                continue
+            row['substitute_key'] = teacher_key(row['substitute_teacher'])
+            slot = (row['date'], row['period'], row['substitute_key'])
+            if slot in slots:
+                skipped += 1
+                continue
+            slots.add(slot)
+            rows.append(row)
+        if rows:
+            connection.execute(Substitution.__table__.insert(), rows)
+        if skipped:
+            # Keep the originals rather than lose rows that could not be converted
+            print(f"{skipped} substitutions with unparseable date/period or a double-booked substitute "
+                  f"left in substitution_legacy", flush=True)
+        else:
+            connection.execute(db.text('DROP TABLE substitution_legacy'))
+
+def migrate_substitution_keys():
+    """Add substitute_key and its unique slot index to a substitution table created without them"""
+    if 'substitute_key' in {column['name'] for column in db.inspect(db.engine).get_columns('substitution')}:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(db.text("ALTER TABLE substitution ADD COLUMN substitute_key VARCHAR(100) NOT NULL DEFAULT ''"))
+        for row in connection.execute(db.text('SELECT id, substitute_teacher FROM substitution')).all():
+            connection.execute(db.text('UPDATE substitution SET substitute_key = :key WHERE id = :id'),
+                               {'key': teacher_key(row.substitute_teacher), 'id': row.id})
+    try:
+        for index in Substitution.__table__.indexes:
+            if index.unique:
+                index.create(db.engine, checkfirst=True)
+    except db.exc.IntegrityError:
+        print('Substitutions already double-book a substitute; ux_substitution_substitute_slot not created', flush=True)
+
+with app.app_context():
+    migrate_substitution_table()
+    db.create_all()
+    migrate_substitution_keys()
+    # Tables created before their indexes and columns were declared
+    for index in TimetableEntry.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    state_columns = {column['name'] for column in db.inspect(db.engine).get_columns('timetable_state')}
+    for column in ('next_row_id', 'substitution_version'):
+        if column not in state_columns:
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE timetable_state ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'))
+    if db.session.get(TimetableState, 1) is None:
+        db.session.add(TimetableState(id=1, version=0))
+        db.session.commit()
+    # Backfill the counters for databases created before they existed
+    if TeacherSubstitutionStats.query.first() is None and Substitution.query.first() is not None:
+        rebuild_substitution_stats()
+
+def allowed_file(filename, extensions=ALLOWED_EXTENSIONS):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
 
 def clean_subject_name(subject):
     """Extract subject name by removing numbers from the end"""
-    if pd.isna(subject):
+    if _is_missing(subject):
         return ""
     return re.sub(r'\d+$', '', str(subject)).strip()
 
 def parse_time_slot(time_slot):
     """Parse time slot and return start and end times"""
-    if pd.isna(time_slot):
+    if _is_missing(time_slot):
         return None, None
     try:
         parts = time_slot.split(' to ')
@@ -82,139 +293,1626 @@ def parse_time_slot(time_slot):
         pass
     return None, None
 
-def detect_clashes(timetable_df):
-    """Detect time clashes where multiple teachers have same class at same time"""
-    clashes = []
-    
-    # Group by Day, Period, and Class/Activity
-    grouped = timetable_df.groupby(['Day', 'Period', 'Class/Activity'])
-    
-    for (day, period, class_activity), group in grouped:
-        if len(group) > 1:
-            teachers_involved = group['Teacher Name'].tolist()
-            subjects_involved = group['Subject'].tolist()
-            time_slots = group['Time Slot'].tolist()
-            
-            clash_teachers = list(set(group['Teacher Name']))
-            clash_subjects = list(set(group['Subject']))
-            
-            clash_info = {
-                'day': day,
-                'period': period,
+def parse_weekday(day):
+    """Return the weekday index (Monday=0) for a day label, or -1 if unknown"""
+    day_name = str(day).strip().lower()
+    for key, value in DAY_MAPPING.items():
+        if day_name.startswith(key):
+            return value.weekday
+    return -1
+
+def time_to_minutes(time_str):
+    """Convert 'HH:MM' into minutes since midnight, or -1 if it cannot be parsed or is out of range"""
+    try:
+        hour, minute = map(int, time_str.split(':'))
+    except (AttributeError, ValueError):
+        return -1
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return -1
+    return hour * 60 + minute
+
+def _cell_text(value):
+    """Interned string for a timetable cell; missing values become ''"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return sys.intern(str(value).strip())
+
+def period_value(period_key):
+    """Period as returned to clients: an int for numeric labels, else the label"""
+    return int(period_key) if period_key.isdigit() else period_key
+
+def parse_day_and_time_columns(days, time_slots):
+    """Weekday and start/end minute arrays for day and time slot columns.
+
+    Each distinct label is parsed once; -1 marks values that cannot be parsed.
+    """
+    weekday_of = {'': -1}
+    minutes_of = {'': (-1, -1)}
+    weekday, start_min, end_min = array('h'), array('h'), array('h')
+    for day, time_slot in zip(days, time_slots):
+        if day not in weekday_of:
+            weekday_of[day] = parse_weekday(day)
+        if time_slot not in minutes_of:
+            start_str, end_str = parse_time_slot(time_slot)
+            minutes_of[time_slot] = (time_to_minutes(start_str) if start_str else -1,
+                                     time_to_minutes(end_str) if end_str else -1)
+        weekday.append(weekday_of[day])
+        start, end = minutes_of[time_slot]
+        start_min.append(start)
+        end_min.append(end)
+    return weekday, start_min, end_min
+
+TIMETABLE_COLUMNS = ['Teacher Name', 'Subject', 'Day', 'Period', 'Time Slot', 'Class/Activity']
+# CompiledTimetable field holding each CSV column, in the same order
+COLUMN_FIELDS = ['teacher', 'subject', 'day', 'period_key', 'time_slot', 'class_activity']
+
+class CodedColumn:
+    """Read-only string column stored as integer codes into a table of distinct values.
+
+    Columns of a mapped snapshot file are CodedColumns over the mapped
+    codes, so the rows are shared between workers instead of being copied
+    into per-process tuples.
+    """
+
+    __slots__ = ('codes', 'strings')
+
+    def __init__(self, codes, strings):
+        self.codes = codes
+        self.strings = strings
+
+    def __getitem__(self, row):
+        return self.strings[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return map(self.strings.__getitem__, self.codes)
+
+def _string_column(values):
+    return values if isinstance(values, CodedColumn) else tuple(values)
+
+class _EditableColumn:
+    """Copy of a string column that rows can be assigned to, for replace_rows()"""
+
+    def __init__(self, column):
+        if isinstance(column, CodedColumn):
+            self.codes, self.strings = array('i', column.codes), list(column.strings)
+            self.code_of = None  # string -> code, built on the first assignment
+            self.values = None
+        else:
+            self.values = list(column)
+
+    def __getitem__(self, row):
+        return self.values[row] if self.values is not None else self.strings[self.codes[row]]
+
+    def __setitem__(self, row, value):
+        if self.values is not None:
+            self.values[row] = value
+            return
+        if self.code_of is None:
+            self.code_of = {string: code for code, string in enumerate(self.strings)}
+        code = self.code_of.get(value)
+        if code is None:
+            code = self.code_of[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        self.codes[row] = code
+
+    def finish(self):
+        return self.values if self.values is not None else CodedColumn(self.codes, tuple(self.strings))
+
+class CompiledTimetable:
+    """Immutable, column-oriented store of the timetable.
+
+    This is the app's copy of the timetable: uploads build a new one and
+    edits derive a new one via replace_rows(), so read routes never rebuild
+    a DataFrame or copy rows. Rows are addressed by position within one
+    snapshot; row_id holds a stable id per row that survives edits and
+    merges, and ids ascend with position (uploads number rows in order,
+    merges append new rows with new ids). Strings are interned and day/period/time slot are pre-parsed
+    into integer columns (-1 where the source value is missing or malformed).
+    """
+
+    __slots__ = ('version', 'row_id', 'next_row_id', 'teacher', 'subject', 'day',
+                 'period', 'period_key', 'time_slot', 'class_activity', 'weekday',
+                 'start_min', 'end_min', 'teachers', 'subjects', 'classes', 'periods',
+                 '_occupancy', 'interval_clashes', 'indexes', '_clash_index')
+
+    def __init__(self, columns, version=0):
+        """Build from a dict mapping each COLUMN_FIELDS name to stripped strings.
+
+        'weekday', 'start_min' and 'end_min' arrays may be passed in already
+        parsed (the CSV ingest does this); otherwise they are derived here.
+        'row_id' and 'next_row_id' carry stable ids over from an earlier
+        snapshot; by default rows are numbered from 0. String columns may be
+        CodedColumns, which are kept as they are.
+        """
+        self.version = version
+        self.row_id = columns['row_id'] if 'row_id' in columns else array('q', range(len(columns['teacher'])))
+        self.next_row_id = max(columns.get('next_row_id', 0), self.row_id[-1] + 1 if len(self.row_id) else 0)
+        self.teacher = _string_column(columns['teacher'])
+        self.subject = _string_column(columns['subject'])
+        self.day = _string_column(columns['day'])
+        self.period_key = _string_column(columns['period_key'])
+        self.time_slot = _string_column(columns['time_slot'])
+        self.class_activity = _string_column(columns['class_activity'])
+        if 'weekday' in columns:
+            self.weekday, self.start_min, self.end_min = columns['weekday'], columns['start_min'], columns['end_min']
+        else:
+            self.weekday, self.start_min, self.end_min = parse_day_and_time_columns(self.day, self.time_slot)
+
+        period_of = {key: period_value(key) for key in set(self.period_key)}
+        if isinstance(self.period_key, CodedColumn):
+            self.period = CodedColumn(self.period_key.codes, tuple(map(period_value, self.period_key.strings)))
+        else:
+            self.period = tuple(period_of[key] for key in self.period_key)
+
+        # Filter dropdown values, computed once per snapshot
+        self.teachers = tuple(sorted(set(self.teacher) - {''}))
+        self.subjects = tuple(sorted(set(self.subject) - {''}))
+        self.classes = tuple(sorted(set(self.class_activity) - {''}))
+        self.periods = tuple(sorted(period_of[key] for key in period_of if key.isdigit()))
+
+        self._occupancy = None  # built on first use
+        self.interval_clashes = None  # filled in lazily by detect_interval_clashes()
+        self.indexes = {}  # per-column indexes and sort orders, built on first use
+        self._clash_index = None  # patched in when the snapshot is published, else built on first use
+
+    @property
+    def occupancy(self):
+        if self._occupancy is None:
+            self._occupancy = OccupancyIndex(self)
+        return self._occupancy
+
+    @property
+    def clash_index(self):
+        if self._clash_index is None:
+            self._clash_index = ClashIndex(self)
+        return self._clash_index
+
+    @clash_index.setter
+    def clash_index(self, index):
+        self._clash_index = index
+
+    def derived_from(self, other):
+        """Reuse the lazily built structures of other, a snapshot with the same rows"""
+        self._occupancy = other._occupancy
+        self.interval_clashes = other.interval_clashes
+        self.indexes = other.indexes
+        self._clash_index = other._clash_index
+
+    @classmethod
+    def from_records(cls, records, version=0):
+        """Build from dicts keyed by the timetable CSV column names"""
+        columns = {field: [] for field in COLUMN_FIELDS}
+        for record in records:
+            for column, field in zip(TIMETABLE_COLUMNS, COLUMN_FIELDS):
+                columns[field].append(_cell_text(record.get(column)))
+        return cls(columns, version)
+
+    def replace_rows(self, changes, version):
+        """New snapshot with rows replaced; changes maps position -> CSV-style dict.
+
+        Coded columns stay coded: their codes are copied and new values are
+        added to the string table, so no column is rebuilt row by row.
+        """
+        columns = {field: _EditableColumn(getattr(self, field)) for field in COLUMN_FIELDS}
+        weekday, start_min, end_min = array('h', self.weekday), array('h', self.start_min), array('h', self.end_min)
+        for row, record in changes.items():
+            for column, field in zip(TIMETABLE_COLUMNS, COLUMN_FIELDS):
+                columns[field][row] = _cell_text(record.get(column))
+            parsed = parse_day_and_time_columns([columns['day'][row]], [columns['time_slot'][row]])
+            weekday[row], start_min[row], end_min[row] = (values[0] for values in parsed)
+        columns = {field: column.finish() for field, column in columns.items()}
+        columns.update(weekday=weekday, start_min=start_min, end_min=end_min,
+                       row_id=self.row_id, next_row_id=self.next_row_id)
+        return CompiledTimetable(columns, version)
+
+    def position(self, row_id):
+        """Position of the row with the given stable id, or None"""
+        position = bisect.bisect_left(self.row_id, row_id)
+        if position < len(self.row_id) and self.row_id[position] == row_id:
+            return position
+        return None
+
+    def record(self, row):
+        """One row as a dict keyed by the timetable CSV column names"""
+        return {
+            'Teacher Name': self.teacher[row],
+            'Subject': self.subject[row],
+            'Day': self.day[row],
+            'Period': self.period[row],
+            'Time Slot': self.time_slot[row],
+            'Class/Activity': self.class_activity[row]
+        }
+
+    def __len__(self):
+        return len(self.teacher)
+
+    def column_index(self, field):
+        """Map each value of a column to the ascending positions of its rows"""
+        index = self.indexes.get(field)
+        if index is None:
+            index = {}
+            for position, value in enumerate(getattr(self, field)):
+                rows = index.get(value)
+                if rows is None:
+                    rows = index[value] = array('i')
+                rows.append(position)
+            self.indexes[field] = index
+        return index
+
+    def sorted_rows(self, sort):
+        """All positions ordered by timetable_sort_key for the given TIMETABLE_SORTS field"""
+        key = ('sorted', sort)
+        rows = self.indexes.get(key)
+        if rows is None:
+            rows = self.indexes[key] = sorted(range(len(self)), key=lambda i: timetable_sort_key(self, sort, i))
+        return rows
+
+    def select(self, teacher='', subject='', class_activity=''):
+        """Return row indices matching the given exact filters (empty = any)"""
+        rows = range(len(self))
+        if teacher:
+            rows = [i for i in rows if self.teacher[i] == teacher]
+        if subject:
+            rows = [i for i in rows if self.subject[i] == subject]
+        if class_activity:
+            rows = [i for i in rows if self.class_activity[i] == class_activity]
+        return rows
+
+SNAPSHOT_MAGIC = b'TTSNAP2\n'
+# Fixed-width columns of a snapshot file; string columns are codes into its string table
+SNAPSHOT_COLUMNS = [('row_id', 'q')] + [(field, 'i') for field in COLUMN_FIELDS] + [
+    ('weekday', 'h'), ('start_min', 'h'), ('end_min', 'h')]
+
+def _padding(size):
+    return b'\0' * (-size % 8)
+
+def write_timetable_snapshot(snapshot, path):
+    """Write a compiled timetable to path as a snapshot file, replacing it atomically.
+
+    Layout: magic, a length-prefixed JSON header (version, row count,
+    string table, column offsets) and the SNAPSHOT_COLUMNS as native
+    arrays, each 8-byte aligned.
+    """
+    strings, code_of = [], {}
+    def code(value):
+        code = code_of.get(value)
+        if code is None:
+            code = code_of[value] = len(strings)
+            strings.append(value)
+        return code
+
+    def encode(column):
+        if isinstance(column, CodedColumn):
+            # Translate the used entries of the column's own string table instead of every row
+            table = [0] * len(column.strings)
+            for used in sorted(set(column.codes)):
+                table[used] = code(column.strings[used])
+            return array('i', map(table.__getitem__, column.codes))
+        return array('i', map(code, column))
+
+    data = []
+    offsets = {}
+    offset = 0
+    for name, typecode in SNAPSHOT_COLUMNS:
+        column = encode(getattr(snapshot, name)) if name in COLUMN_FIELDS else array(typecode, getattr(snapshot, name))
+        offsets[name] = offset
+        data.append(column.tobytes())
+        offset += len(data[-1]) + len(_padding(len(data[-1])))
+    header = json.dumps({
+        'version': snapshot.version, 'next_row_id': snapshot.next_row_id, 'rows': len(snapshot),
+        'byteorder': sys.byteorder, 'strings': strings, 'offsets': offsets
+    }).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.snapshot', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            prefix = SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header
+            f.write(prefix + _padding(len(prefix)))
+            for chunk in data:
+                f.write(chunk + _padding(len(chunk)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def map_timetable_snapshot(path):
+    """Compiled timetable whose columns are read-only views of the mmapped snapshot file.
+
+    The pages are shared by every worker mapping the same file, and a
+    mapping stays valid after the file is replaced by a newer version.
+    Raises OSError or ValueError if the file is missing or unreadable.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a timetable snapshot')
+        (header_size,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{path} was written on a {header["byteorder"]}-endian machine')
+
+    view = memoryview(mapped)
+    start = len(SNAPSHOT_MAGIC) + 4 + header_size
+    start += -start % 8
+    rows = header['rows']
+    strings = tuple(map(sys.intern, header['strings']))
+    columns = {}
+    for name, typecode in SNAPSHOT_COLUMNS:
+        offset = start + header['offsets'][name]
+        column = view[offset:offset + rows * array(typecode).itemsize].cast(typecode)
+        columns[name] = CodedColumn(column, strings) if name in COLUMN_FIELDS else column
+    columns['next_row_id'] = header['next_row_id']
+    return CompiledTimetable(columns, header['version'])
+
+def share_timetable_snapshot(snapshot):
+    """Write snapshot to the shared snapshot file and return the mapped copy.
+
+    Falls back to the in-memory snapshot if the file cannot be written, or
+    if another worker replaced it with a different version in between.
+    """
+    path = app.config['TIMETABLE_SNAPSHOT_FILE']
+    try:
+        write_timetable_snapshot(snapshot, path)
+        mapped = map_timetable_snapshot(path)
+    except (OSError, ValueError) as e:
+        print('Error writing timetable snapshot:', e, flush=True)
+        return snapshot
+    if mapped.version != snapshot.version:
+        return snapshot
+    mapped.derived_from(snapshot)
+    return mapped
+
+def _period_sort_key(period_key):
+    return (0, int(period_key), '') if period_key.isdigit() else (1, 0, period_key)
+
+# Sortable fields of GET /api/timetable -> primary sort values of the row at position i
+TIMETABLE_SORTS = {
+    'teacher': lambda snapshot, i: (snapshot.teacher[i],),
+    'subject': lambda snapshot, i: (snapshot.subject[i],),
+    'class': lambda snapshot, i: (snapshot.class_activity[i],),
+    'day': lambda snapshot, i: (snapshot.weekday[i], snapshot.day[i]),
+    'period': lambda snapshot, i: _period_sort_key(snapshot.period_key[i]),
+    'time_slot': lambda snapshot, i: (snapshot.start_min[i], snapshot.end_min[i])
+}
+
+def timetable_sort_key(snapshot, sort, i):
+    """Flat sort key: the sort field, then day and period, then the stable row id"""
+    return (TIMETABLE_SORTS[sort](snapshot, i) + (snapshot.weekday[i],)
+            + _period_sort_key(snapshot.period_key[i]) + (snapshot.row_id[i],))
+
+def iter_bits(mask):
+    """Yield the positions of the set bits in mask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class OccupancyIndex:
+    """Bitset index of who teaches when, built once per compiled snapshot.
+
+    Every teacher gets an integer bitmap over (weekday, period) slots and
+    every slot gets an integer bitmap over teacher ids, so free/busy checks
+    are bit operations rather than scans over the timetable rows. Teacher
+    ids are positions in the snapshot's sorted teachers tuple, so iterating
+    a teacher mask yields names in sorted order.
+    """
+
+    def __init__(self, snapshot):
+        self.teachers = snapshot.teachers
+        self.teacher_ids = {name: tid for tid, name in enumerate(self.teachers)}
+        self.all_teachers = (1 << len(self.teachers)) - 1
+        self.period_slots = {}                       # period key -> period index
+        self.teacher_busy = [0] * len(self.teachers)  # teacher id -> slot bitmap
+        self.slot_busy = {}                          # slot -> teacher bitmap
+        self.subject_teachers = {}                   # lowercased subject -> teacher bitmap
+        self.class_teachers = {}                     # lowercased class -> teacher bitmap
+        teacher_subjects = [set() for _ in self.teachers]
+
+        for i in range(len(snapshot)):
+            tid = self.teacher_ids.get(snapshot.teacher[i])
+            if tid is None:
+                continue
+            bit = 1 << tid
+            subject = snapshot.subject[i]
+            teacher_subjects[tid].add(subject)
+            subject_lower = subject.lower()
+            self.subject_teachers[subject_lower] = self.subject_teachers.get(subject_lower, 0) | bit
+            class_lower = snapshot.class_activity[i].lower()
+            self.class_teachers[class_lower] = self.class_teachers.get(class_lower, 0) | bit
+
+            weekday, period_key = snapshot.weekday[i], snapshot.period_key[i]
+            if weekday >= 0 and period_key:
+                period_idx = self.period_slots.setdefault(period_key, len(self.period_slots))
+                slot = period_idx * 7 + weekday
+                self.teacher_busy[tid] |= 1 << slot
+                self.slot_busy[slot] = self.slot_busy.get(slot, 0) | bit
+
+        # Per-teacher subject lists, with lowercased copies for partial matching
+        self.teacher_subjects = [
+            tuple((subject, subject.lower()) for subject in sorted(subjects))
+            for subjects in teacher_subjects
+        ]
+        self.period_keys = sorted(self.period_slots, key=_period_sort_key)
+
+    def slot(self, weekday, period_key):
+        """Slot number for (weekday, period), or None if the period is unknown"""
+        period_idx = self.period_slots.get(str(period_key).strip())
+        return None if period_idx is None else period_idx * 7 + weekday
+
+    def busy_mask(self, weekday, period_key):
+        """Bitmap of teachers with a lesson in the given weekday/period"""
+        slot = self.slot(weekday, period_key)
+        return 0 if slot is None else self.slot_busy.get(slot, 0)
+
+    def candidate_mask(self, subjects_lower=(), classes_lower=()):
+        """Bitmap of teachers matching the subject (substring) and class filters"""
+        mask = self.all_teachers
+        if subjects_lower:
+            subject_mask = 0
+            for subject_lower, teachers in self.subject_teachers.items():
+                if any(subj in subject_lower for subj in subjects_lower):
+                    subject_mask |= teachers
+            mask &= subject_mask
+        if classes_lower:
+            class_mask = 0
+            for class_lower in classes_lower:
+                class_mask |= self.class_teachers.get(class_lower, 0)
+            mask &= class_mask
+        return mask
+
+    def free_teacher_subjects(self, weekday, period_key, subjects_lower=(), classes_lower=()):
+        """Free teachers for a weekday/period as {'name', 'subject'} dicts"""
+        return self.free_teachers_by_period(weekday, [period_key], subjects_lower, classes_lower)[period_key]
+
+    def free_teachers_by_period(self, weekday, period_keys, subjects_lower=(), classes_lower=()):
+        """Free teachers for several periods of one weekday, keyed by period.
+
+        The subject/class candidate mask and each teacher's matching subjects
+        are worked out once and shared by every requested period.
+        """
+        candidates = self.candidate_mask(subjects_lower, classes_lower)
+        teacher_entries = {}
+        result = {}
+        for period_key in period_keys:
+            entries = []
+            for tid in iter_bits(candidates & ~self.busy_mask(weekday, period_key)):
+                if tid not in teacher_entries:
+                    name = self.teachers[tid]
+                    teacher_entries[tid] = [
+                        {'name': name, 'subject': subject}
+                        for subject, subject_lower in self.teacher_subjects[tid]
+                        if not subjects_lower or any(subj in subject_lower for subj in subjects_lower)
+                    ]
+                entries.extend(teacher_entries[tid])
+            result[period_key] = entries
+        return result
+
+    def is_busy(self, teacher, weekday, period_key):
+        """Whether the teacher has a lesson in the given weekday/period; None for unknown teachers"""
+        tid = self.teacher_ids.get(teacher)
+        if tid is None:
+            return None
+        return bool(self.busy_mask(weekday, period_key) >> tid & 1)
+
+    def teacher_periods(self, teacher, weekday):
+        """Period labels the teacher is timetabled for on the given weekday"""
+        tid = self.teacher_ids.get(teacher)
+        if tid is None:
+            return []
+        busy = self.teacher_busy[tid]
+        return [key for key in self.period_keys if busy >> (self.period_slots[key] * 7 + weekday) & 1]
+
+class ClashIndex:
+    """Timetable rows grouped by (day, period, class) and (day, period, teacher).
+
+    Built the first time a snapshot's clashes are needed; edits and merges
+    then derive the next snapshot's index with updated(), which moves only
+    the touched rows between groups and shares every other group with the
+    index it was derived from, so neither an edit nor listing clashes
+    rescans the whole timetable. Each snapshot carries its own index
+    (CompiledTimetable.clash_index), so a reader always sees an index that
+    matches its snapshot. Rows are filed by their stable row id. Days are
+    keyed by weekday where the label can be parsed.
+    """
+
+    def __init__(self, snapshot=None):
+        self.groups = {'class': {}, 'teacher': {}}    # kind -> key -> {row id: None}
+        self.clashing = {'class': set(), 'teacher': set()}
+        self.owned = None                             # (kind, key)s of groups this index has copied
+        for i in range(len(snapshot) if snapshot is not None else 0):
+            self._add(snapshot.row_id[i], self._keys(snapshot, i))
+        self.owned = set()                            # groups are shared with indexes derived from this one
+
+    @staticmethod
+    def _keys(snapshot, i):
+        weekday, period_key = snapshot.weekday[i], snapshot.period_key[i]
+        day_key = weekday if weekday >= 0 else snapshot.day[i].lower()
+        if day_key == '' or not period_key:
+            return (None, None)
+        class_activity, teacher = snapshot.class_activity[i], snapshot.teacher[i]
+        return ((day_key, period_key, class_activity) if class_activity else None,
+                (day_key, period_key, teacher) if teacher else None)
+
+    def _group(self, kind, key):
+        """Group dict for key that may be modified, copied first if it is shared"""
+        group = self.groups[kind].get(key)
+        if group is None:
+            group = self.groups[kind][key] = {}
+        elif self.owned is not None and (kind, key) not in self.owned:
+            group = self.groups[kind][key] = dict(group)
+        if self.owned is not None:
+            self.owned.add((kind, key))
+        return group
+
+    def _add(self, row, keys):
+        for kind, key in zip(('class', 'teacher'), keys):
+            if key is not None:
+                group = self._group(kind, key)
+                group[row] = None
+                if len(group) > 1:
+                    self.clashing[kind].add(key)
+
+    def _remove(self, row, keys):
+        for kind, key in zip(('class', 'teacher'), keys):
+            if key is not None:
+                group = self._group(kind, key)
+                del group[row]
+                if len(group) < 2:
+                    self.clashing[kind].discard(key)
+                if not group:
+                    del self.groups[kind][key]
+
+    def updated(self, previous, snapshot, changed_ids, removed_ids=()):
+        """Index for snapshot: a copy of this one, the index of previous, with rows
+        (by id) that were edited or added re-filed and removed ones dropped.
+        This index is left unchanged.
+
+        Only the outer containers and the groups that rows leave or join are
+        copied; all other groups are shared with this index.
+        """
+        index = ClashIndex()
+        index.groups = {kind: dict(groups) for kind, groups in self.groups.items()}
+        index.clashing = {kind: set(keys) for kind, keys in self.clashing.items()}
+        index.owned = set()
+        for row_id in removed_ids:
+            index._remove(row_id, index._keys(previous, previous.position(row_id)))
+        for row_id in changed_ids:
+            keys = index._keys(snapshot, snapshot.position(row_id))
+            old_position = previous.position(row_id)
+            old_keys = index._keys(previous, old_position) if old_position is not None else None
+            if keys != old_keys:
+                if old_keys is not None:
+                    index._remove(row_id, old_keys)
+                index._add(row_id, keys)
+        index.owned = set()
+        return index
+
+    def clashes(self, snapshot):
+        """Clash dicts: classes with several lessons in a slot, then double-booked teachers"""
+        return [clash for _, clash in self.clash_entries(snapshot)]
+
+    def clash_entries(self, snapshot, keys=None):
+        """((kind, key), clash dict) pairs in clashes() order, optionally only for the given (kind, key)s"""
+        groups = {kind: [(key, sorted(snapshot.position(row_id) for row_id in self.groups[kind][key]))
+                         for key in self.clashing[kind]
+                         if keys is None or (kind, key) in keys]
+                  for kind in self.groups}
+
+        def sort_key(item):
+            (day_key, period_key, name), rows = item
+            return (isinstance(day_key, str), str(day_key) if isinstance(day_key, str) else day_key,
+                    _period_sort_key(period_key), name)
+
+        clashes = []
+        for key, rows in sorted(groups['class'], key=sort_key):
+            class_activity = key[2]
+            clashes.append((('class', key), {
+                'type': 'class',
+                'day': snapshot.day[rows[0]],
+                'period': snapshot.period[rows[0]],
                 'class_activity': class_activity,
-                'teachers': teachers_involved,
-                'subjects': subjects_involved,
-                'time_slot': time_slots[0] if time_slots else '',
-                'count': len(group)
-            }
-            clashes.append(clash_info)
-    
+                'teachers': [snapshot.teacher[i] for i in rows],
+                'subjects': [snapshot.subject[i] for i in rows],
+                'time_slot': snapshot.time_slot[rows[0]],
+                'count': len(rows)
+            }))
+        for key, rows in sorted(groups['teacher'], key=sort_key):
+            teacher = key[2]
+            clashes.append((('teacher', key), {
+                'type': 'teacher',
+                'day': snapshot.day[rows[0]],
+                'period': snapshot.period[rows[0]],
+                'teacher': teacher,
+                'classes': [snapshot.class_activity[i] for i in rows],
+                'subjects': [snapshot.subject[i] for i in rows],
+                'time_slot': snapshot.time_slot[rows[0]],
+                'count': len(rows)
+            }))
+        return clashes
+
+    @classmethod
+    def row_group_keys(cls, snapshot, position):
+        """(kind, key)s of the groups the row at position belongs to"""
+        return {(kind, key) for kind, key in zip(('class', 'teacher'), cls._keys(snapshot, position)) if key is not None}
+
+def clash_delta(before, after):
+    """Clashes added, resolved and changed between two {(kind, key): clash} dicts"""
+    return {
+        'added': [clash for key, clash in after.items() if key not in before],
+        'resolved': [clash for key, clash in before.items() if key not in after],
+        'changed': [clash for key, clash in after.items() if key in before and before[key] != clash]
+    }
+
+def minutes_to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def detect_interval_clashes(snapshot):
+    """Clashes between lessons whose time slots overlap, whatever their period labels.
+
+    Rows are bucketed per weekday and class (and per weekday and teacher),
+    sorted by start time and swept once, collecting each run of overlapping
+    lessons. That keeps it O(n log n); the result is memoized per snapshot.
+    """
+    if snapshot.interval_clashes is not None:
+        return snapshot.interval_clashes
+
+    start_min, end_min = snapshot.start_min, snapshot.end_min
+    buckets = {'class': {}, 'teacher': {}}
+    for i in range(len(snapshot)):
+        weekday = snapshot.weekday[i]
+        if weekday < 0 or start_min[i] < 0 or end_min[i] <= start_min[i]:
+            continue
+        if snapshot.class_activity[i]:
+            buckets['class'].setdefault((weekday, snapshot.class_activity[i]), []).append(i)
+        if snapshot.teacher[i]:
+            buckets['teacher'].setdefault((weekday, snapshot.teacher[i]), []).append(i)
+
+    def clash_info(kind, name, run, run_end):
+        info = {
+            'type': kind,
+            'day': snapshot.day[run[0]],
+            'start': minutes_to_time(start_min[run[0]]),
+            'end': minutes_to_time(run_end),
+            'periods': [snapshot.period[i] for i in run],
+            'time_slots': [snapshot.time_slot[i] for i in run],
+            'subjects': [snapshot.subject[i] for i in run],
+            'count': len(run)
+        }
+        if kind == 'class':
+            info['class_activity'] = name
+            info['teachers'] = [snapshot.teacher[i] for i in run]
+        else:
+            info['teacher'] = name
+            info['classes'] = [snapshot.class_activity[i] for i in run]
+        return info
+
+    clashes = []
+    for kind in ('class', 'teacher'):
+        for (weekday, name), rows in sorted(buckets[kind].items()):
+            if len(rows) < 2:
+                continue
+            rows.sort(key=lambda i: (start_min[i], end_min[i], i))
+            run, run_end = [rows[0]], end_min[rows[0]]
+            for i in rows[1:]:
+                if start_min[i] < run_end:
+                    run.append(i)
+                    run_end = max(run_end, end_min[i])
+                    continue
+                if len(run) > 1:
+                    clashes.append(clash_info(kind, name, run, run_end))
+                run, run_end = [i], end_min[i]
+            if len(run) > 1:
+                clashes.append(clash_info(kind, name, run, run_end))
+
+    snapshot.interval_clashes = clashes
     return clashes
 
-def generate_rrule_events(timetable_df, start_date, end_date):
-    """Generate calendar events using RRULE for recurring timetable entries"""
-    # Remove exact duplicate timetable rows based on key columns
-    timetable_df = timetable_df.drop_duplicates(
-        subset=['Teacher Name', 'Subject', 'Day', 'Period', 'Time Slot', 'Class/Activity']
-    )
-    events = []
-    
-    for idx, row in timetable_df.iterrows():
-        day_name = str(row['Day']).lower()
-        
-        # Map day name to rrule day
-        rrule_day = None
-        for key, value in DAY_MAPPING.items():
-            if day_name.startswith(key):
-                rrule_day = value
+class PayloadCache:
+    """Thread-safe LRU cache of serialized responses, bounded by count and size.
+
+    generation changes on every invalidation. Callers read it before
+    computing a payload and pass it to put(), which drops payloads computed
+    from data that has since been invalidated.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (payload, etag)
+        self.size = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, payload, generation):
+        """Store payload under key and return its (payload, etag) entry"""
+        entry = (payload, hashlib.sha1(payload).hexdigest())
+        if len(payload) > self.max_bytes:
+            return entry
+        with self.lock:
+            if generation != self.generation:
+                return entry
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = entry
+            self.size += len(payload)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation += 1
+
+    def invalidate(self, predicate):
+        """Drop every entry whose key satisfies predicate"""
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.size -= len(self.entries.pop(key)[0])
+            self.generation += 1
+
+events_cache = PayloadCache(app.config['EVENTS_CACHE_MAX_ENTRIES'], app.config['EVENTS_CACHE_MAX_BYTES'])
+
+class TimetableVersionConflict(RuntimeError):
+    """Another worker published the timetable while this one was writing"""
+
+def _entry_values(snapshot, positions):
+    return [{
+        'id': snapshot.row_id[i],
+        'teacher_name': snapshot.teacher[i],
+        'subject': snapshot.subject[i],
+        'day': snapshot.day[i],
+        'period': snapshot.period_key[i],
+        'time_slot': snapshot.time_slot[i],
+        'class_activity': snapshot.class_activity[i]
+    } for i in positions]
+
+def _persist_timetable(snapshot, base_version, changed_ids=None, removed_ids=()):
+    """Write a snapshot to timetable_entry and bump the stored version in one transaction.
+
+    A whole timetable is rewritten with one bulk insert; with changed_ids
+    only the changed, added and removed rows are touched. Raises
+    TimetableVersionConflict if the stored version is no longer base_version.
+    """
+    table = TimetableEntry.__table__
+    with db.engine.begin() as connection:
+        bumped = connection.execute(
+            TimetableState.__table__.update()
+            .where(TimetableState.id == 1, TimetableState.version == base_version)
+            .values(version=snapshot.version, next_row_id=snapshot.next_row_id)
+        )
+        if bumped.rowcount != 1:
+            raise TimetableVersionConflict('The timetable was changed by another user, please try again')
+        if changed_ids is None:
+            connection.execute(table.delete())
+            positions = range(len(snapshot))
+        else:
+            stale = list(removed_ids) + list(changed_ids)
+            for start in range(0, len(stale), 500):
+                connection.execute(table.delete().where(table.c.id.in_(stale[start:start + 500])))
+            positions = [snapshot.position(rid) for rid in changed_ids]
+        values = _entry_values(snapshot, positions)
+        if values:
+            connection.execute(table.insert(), values)
+
+def load_timetable_from_database():
+    """Compile the stored timetable, or return None if none was ever stored"""
+    state = TimetableState.__table__
+    table = TimetableEntry.__table__
+    stored_state = db.select(state.c.version, state.c.next_row_id).where(state.c.id == 1)
+    with db.engine.connect() as connection:
+        while True:
+            version, next_row_id = connection.execute(stored_state).one()
+            if not version:
+                return None
+            columns = {field: [] for field in COLUMN_FIELDS}
+            row_id = array('q')
+            for row in connection.execute(db.select(
+                table.c.id, table.c.teacher_name, table.c.subject, table.c.day,
+                table.c.period, table.c.time_slot, table.c.class_activity
+            ).order_by(table.c.id)):
+                row_id.append(row[0])
+                for field, value in zip(COLUMN_FIELDS, row[1:]):
+                    columns[field].append(sys.intern(value))
+            # Read again in case another worker published while the rows were read
+            if connection.execute(stored_state).one()[0] == version:
                 break
-        
-        if not rrule_day:
+    columns.update(row_id=row_id, next_row_id=next_row_id)
+    return CompiledTimetable(columns, version)
+
+def _stored_timetable_version():
+    version = db.session.query(TimetableState.version).filter_by(id=1).scalar()
+    db.session.rollback()
+    return version
+
+def bump_substitution_version():
+    """Mark saved substitutions as changed; call before committing them"""
+    db.session.execute(TimetableState.__table__.update().where(TimetableState.id == 1)
+                       .values(substitution_version=TimetableState.substitution_version + 1))
+
+_seen_substitution_version = None
+
+def _refresh_substitution_events():
+    """Drop overlaid event payloads if another worker saved substitutions"""
+    global _seen_substitution_version
+    version = db.session.query(TimetableState.substitution_version).filter_by(id=1).scalar()
+    db.session.rollback()
+    if version != _seen_substitution_version:
+        if _seen_substitution_version is not None:
+            invalidate_substitution_events()
+        _seen_substitution_version = version
+
+def _load_stored_timetable(version):
+    """Map the shared snapshot file if it holds version, else compile the stored rows and share them"""
+    try:
+        snapshot = map_timetable_snapshot(app.config['TIMETABLE_SNAPSHOT_FILE'])
+        if snapshot.version == version:
+            return snapshot
+    except (OSError, ValueError):
+        pass
+    snapshot = load_timetable_from_database()
+    return None if snapshot is None else share_timetable_snapshot(snapshot)
+
+def set_teachers(records):
+    """Replace the teachers list and save it for other workers and restarts"""
+    global teachers_data, _teachers_mtime
+    path = app.config['TEACHERS_FILE']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+    os.replace(tmp_path, path)
+    teachers_data, _teachers_mtime = records, os.stat(path).st_mtime_ns
+
+_teachers_mtime = None
+
+def _refresh_teachers():
+    """Reload the saved teachers list if it changed since it was last read"""
+    global teachers_data, _teachers_mtime
+    try:
+        mtime = os.stat(app.config['TEACHERS_FILE']).st_mtime_ns
+        if mtime != _teachers_mtime:
+            with open(app.config['TEACHERS_FILE'], encoding='utf-8') as f:
+                teachers_data = json.load(f)
+            _teachers_mtime = mtime
+    except FileNotFoundError:
+        pass
+
+def _sync_from_database():
+    """Load the stored timetable if it is newer than ours. Callers hold timetable_write_lock."""
+    version = _stored_timetable_version()
+    if version not in (None, timetable_snapshot.version):
+        snapshot = _load_stored_timetable(version)
+        if snapshot is not None:
+            _publish_timetable(snapshot, persist=False)
+
+_last_refresh_check = 0.0
+
+def refresh_timetable(force=False):
+    """Pick up a timetable, teachers list or substitutions saved by another worker
+    (or before a restart), checking at most every TIMETABLE_REFRESH_INTERVAL seconds"""
+    global _last_refresh_check
+    now = time.monotonic()
+    if not force and now - _last_refresh_check < app.config['TIMETABLE_REFRESH_INTERVAL']:
+        return
+    _last_refresh_check = now
+    _refresh_teachers()
+    _refresh_substitution_events()
+    if _stored_timetable_version() not in (None, timetable_snapshot.version):
+        with timetable_write_lock:
+            _sync_from_database()
+
+def _publish_timetable(snapshot, changed_ids=None, removed_ids=(), affected=None, persist=True):
+    """Swap in a fully built snapshot so readers never see a partial one.
+
+    With changed_ids (row ids edited or added) and removed_ids the clash
+    index is patched rather than rebuilt, and only cached event payloads
+    whose filters touch the affected teachers/subjects/classes are dropped.
+    With persist the snapshot is written to the database and the shared
+    snapshot file first, so other workers pick it up, and the mapped copy
+    is published. Callers hold timetable_write_lock.
+    """
+    global timetable_snapshot
+    if persist:
+        try:
+            _persist_timetable(snapshot, timetable_snapshot.version, changed_ids, removed_ids)
+        except TimetableVersionConflict:
+            _sync_from_database()
+            raise
+        snapshot = share_timetable_snapshot(snapshot)
+    if changed_ids is None:
+        timetable_snapshot = snapshot
+        events_cache.clear()
+    else:
+        previous = timetable_snapshot
+        if previous._clash_index is not None:
+            snapshot.clash_index = previous.clash_index.updated(previous, snapshot, changed_ids, removed_ids)
+        timetable_snapshot = snapshot
+        events_cache.invalidate(lambda key: events_key_affected(key, affected))
+    return snapshot
+
+def _affected_values(snapshot, positions):
+    """Teachers, subjects and classes of the rows at the given positions"""
+    return {
+        'teacher': {snapshot.teacher[i] for i in positions},
+        'subject': {clean_subject_name(snapshot.subject[i]) for i in positions} | {snapshot.subject[i] for i in positions},
+        'class': {snapshot.class_activity[i] for i in positions}
+    }
+
+def _merge_affected(*affected_sets):
+    return {field: set().union(*(a[field] for a in affected_sets)) for field in ('teacher', 'subject', 'class')}
+
+def replace_timetable(columns):
+    """Publish a whole new timetable built from CompiledTimetable columns.
+
+    Rows are numbered on from the current timetable's next_row_id, so ids
+    held by clients never point at rows of the new upload.
+    """
+    with timetable_write_lock:
+        _sync_from_database()
+        first_id = timetable_snapshot.next_row_id
+        rows = len(columns['teacher'])
+        columns = dict(columns, row_id=array('q', range(first_id, first_id + rows)), next_row_id=first_id + rows)
+        return _publish_timetable(CompiledTimetable(columns, timetable_snapshot.version + 1))
+
+def edit_timetable_rows(changes, expected_version=None):
+    """Publish the current timetable with a batch of rows edited.
+
+    changes maps stable row id -> CSV-style dict of the columns to change;
+    missing columns keep their values. The batch becomes one snapshot, so
+    the database, clash index and event cache are updated once. Returns
+    (snapshot, clash delta for the touched slots). Raises
+    TimetableVersionConflict if expected_version is given and is not the
+    current version, and KeyError if a row id is not in the timetable.
+    """
+    with timetable_write_lock:
+        _sync_from_database()
+        current = timetable_snapshot
+        if expected_version is not None and expected_version != current.version:
+            raise TimetableVersionConflict(
+                f'The timetable is at version {current.version}, not {expected_version}; reload and try again')
+        positions = {}
+        for row_id, fields in changes.items():
+            position = current.position(row_id)
+            if position is None:
+                raise KeyError(f'No timetable row with id {row_id}')
+            record = current.record(position)
+            record.update(fields)
+            positions[position] = record
+        snapshot = current.replace_rows(positions, current.version + 1)
+        affected = _merge_affected(_affected_values(current, positions), _affected_values(snapshot, positions))
+        touched = set()
+        for position in positions:
+            touched |= ClashIndex.row_group_keys(current, position)
+            touched |= ClashIndex.row_group_keys(snapshot, position)
+        before = dict(current.clash_index.clash_entries(current, touched))
+        snapshot = _publish_timetable(snapshot, changed_ids=list(changes), affected=affected)
+        after = dict(snapshot.clash_index.clash_entries(snapshot, touched))
+        return snapshot, clash_delta(before, after)
+
+def _row_match_keys(get):
+    """(Teacher Name, Day, Period, Class/Activity, n) per row; n numbers repeats of the same key"""
+    seen = {}
+    keys = []
+    for key in zip(get('teacher'), get('day'), get('period_key'), get('class_activity')):
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        keys.append(key + (n,))
+    return keys
+
+def merge_timetable(columns):
+    """Apply uploaded columns as a delta against the current timetable.
+
+    Rows are matched on (Teacher Name, Day, Period, Class/Activity). Matched
+    rows whose subject or time slot differ are updated in place, current
+    rows missing from the upload are removed and unmatched uploaded rows are
+    appended. Untouched rows keep their ids, so only the affected clash
+    groups and cached event payloads are invalidated.
+    Returns (snapshot, diff summary).
+    """
+    with timetable_write_lock:
+        _sync_from_database()
+        current = timetable_snapshot
+        current_column = lambda field: getattr(current, field)
+        incoming_column = columns.__getitem__
+        current_keys = _row_match_keys(current_column)
+        incoming_keys = _row_match_keys(incoming_column)
+        incoming_index = {key: j for j, key in enumerate(incoming_keys)}
+
+        merged = {field: [] for field in COLUMN_FIELDS}
+        merged.update(weekday=array('h'), start_min=array('h'), end_min=array('h'), row_id=array('q'))
+        def take(column, i, rid):
+            for field in COLUMN_FIELDS + ['weekday', 'start_min', 'end_min']:
+                merged[field].append(column(field)[i])
+            merged['row_id'].append(rid)
+
+        removed, changed, matched = [], [], set()
+        for position, key in enumerate(current_keys):
+            j = incoming_index.get(key)
+            if j is None:
+                removed.append(position)
+                continue
+            matched.add(j)
+            if (current.subject[position], current.time_slot[position]) != (columns['subject'][j], columns['time_slot'][j]):
+                changed.append(position)
+                take(incoming_column, j, current.row_id[position])
+            else:
+                take(current_column, position, current.row_id[position])
+        added = [j for j in range(len(incoming_keys)) if j not in matched]
+        next_row_id = current.next_row_id
+        for j in added:
+            take(incoming_column, j, next_row_id)
+            next_row_id += 1
+
+        diff = {'added': len(added), 'removed': len(removed), 'changed': len(changed),
+                'unchanged': len(current) - len(removed) - len(changed)}
+        if not (added or removed or changed):
+            diff.update(teachers=[], classes=[])
+            return current, diff
+
+        merged['next_row_id'] = next_row_id
+        snapshot = CompiledTimetable(merged, current.version + 1)
+        changed_ids = [current.row_id[p] for p in changed] + list(range(current.next_row_id, next_row_id))
+        affected = _merge_affected(
+            _affected_values(current, removed + changed),
+            _affected_values(snapshot, [snapshot.position(rid) for rid in changed_ids])
+        )
+        diff.update(teachers=sorted(affected['teacher'] - {''}), classes=sorted(affected['class'] - {''}))
+        snapshot = _publish_timetable(snapshot, changed_ids=changed_ids,
+                                      removed_ids=[current.row_id[p] for p in removed], affected=affected)
+        return snapshot, diff
+
+timetable_write_lock = threading.Lock()
+timetable_snapshot = CompiledTimetable.from_records([])
+
+with app.app_context():
+    refresh_timetable(force=True)
+
+@app.before_request
+def refresh_timetable_before_request():
+    try:
+        refresh_timetable()
+    except Exception as e:
+        print('Error refreshing timetable from database:', e, flush=True)
+
+def build_week_templates(snapshot, rows):
+    """Materialise one week of event templates for the given snapshot rows.
+
+    Returns {weekday: [template, ...]}. Each template carries everything an
+    event needs except its date, so expansion only has to stamp dates.
+    Rows that would produce identical events are dropped here, once, rather
+    than deduplicating every expanded occurrence.
+    """
+    templates = {}
+    seen = set()
+    colors = {}
+    for idx in rows:
+        weekday = snapshot.weekday[idx]
+        start_min = snapshot.start_min[idx]
+        end_min = snapshot.end_min[idx]
+        if weekday < 0 or start_min < 0 or end_min < 0:
             continue
-        
-        # Parse time slot
-        start_time_str, end_time_str = parse_time_slot(row['Time Slot'])
-        if not start_time_str or not end_time_str:
+
+        teacher = snapshot.teacher[idx]
+        subject = clean_subject_name(snapshot.subject[idx])
+        title = f"{teacher} - {subject}"
+        class_activity = snapshot.class_activity[idx]
+        period = snapshot.period[idx]
+        key = (weekday, title, start_min, end_min, teacher, subject, class_activity, period)
+        if key in seen:
             continue
-        
-        try:
-            # Create RRULE for weekly recurrence
-            rule = rrule(
-                WEEKLY,
-                byweekday=rrule_day,
-                dtstart=start_date,
-                until=end_date
+        seen.add(key)
+
+        if teacher not in colors:
+            colors[teacher] = get_color_for_teacher(teacher)
+        templates.setdefault(weekday, []).append({
+            'row': snapshot.row_id[idx],
+            'start_min': start_min,
+            'end_min': end_min,
+            'title': title,
+            'teacher': teacher,
+            'subject': subject,
+            'class': class_activity,
+            'period': period,
+            'day': snapshot.day[idx],
+            'color': colors[teacher],
+            'extendedProps': {
+                'teacher': teacher,
+                'subject': subject,
+                'class': class_activity,
+                'period': period,
+                'timeSlot': snapshot.time_slot[idx]
+            }
+        })
+    return templates
+
+def occurrence_dates_by_weekday(start_date, end_date):
+    """ISO dates in the range for each weekday, as {weekday: ['YYYY-MM-DD', ...]}.
+
+    Matches the weekly rrule the calendar used to build: occurrences fall at
+    start_date's time of day and the range end is inclusive.
+    """
+    if end_date.tzinfo is not None:
+        if start_date.tzinfo is not None:
+            end_date = end_date.astimezone(start_date.tzinfo)
+        end_date = end_date.replace(tzinfo=None)
+    start_naive = start_date.replace(tzinfo=None)
+    last = end_date.date()
+    if end_date.time() < start_naive.time():
+        last -= timedelta(days=1)
+
+    first_day = start_naive.date()
+    if last < first_day:
+        return {}
+    dates = {}
+    for weekday in range(7):
+        day = first_day + timedelta(days=(weekday - first_day.weekday()) % 7)
+        dates[weekday] = [(day + timedelta(weeks=week)).isoformat()
+                          for week in range((last - day).days // 7 + 1)] if day <= last else []
+    return dates
+
+def dates_in_order(templates, dates_by_weekday):
+    """(iso_date, weekday) pairs, in date order, for weekdays that have templates"""
+    return sorted(
+        (day, weekday)
+        for weekday, days in dates_by_weekday.items() if weekday in templates
+        for day in days
+    )
+
+class SubstitutionOverlay:
+    """Recorded substitutions for one /api/events range, indexed for expansion.
+
+    Loaded with a single indexed query over the request's dates. covering()
+    finds the substitution for an occurrence with one dict lookup, keyed by
+    (date, period, normalized original teacher). With a teacher filter, the
+    lessons that teacher covers for others are collected as duties.
+    """
+
+    def __init__(self, snapshot, dates_by_weekday, teacher_filter='', subject_filter='', class_filter=''):
+        self.by_slot = {}   # (iso date, period, teacher key) -> [Substitution]
+        self.duties = []    # (iso date, template, Substitution), in date order
+        days = [day for days in dates_by_weekday.values() for day in days]
+        if not days:
+            self.dates = set()
+            return
+
+        query = Substitution.query.filter(Substitution.date.between(
+            datetime.strptime(min(days), '%Y-%m-%d').date(), datetime.strptime(max(days), '%Y-%m-%d').date()
+        ))
+        if teacher_filter:
+            query = query.filter(db.or_(Substitution.original_teacher == teacher_filter,
+                                        Substitution.substitute_teacher == teacher_filter))
+        duty_subs = []
+        for sub in query.order_by(Substitution.date, Substitution.period, Substitution.id):
+            key = (sub.date.isoformat(), str(sub.period), teacher_key(sub.original_teacher))
+            self.by_slot.setdefault(key, []).append(sub)
+            if teacher_filter and sub.substitute_teacher == teacher_filter:
+                duty_subs.append(sub)
+        self.dates = {key[0] for key in self.by_slot}
+        if duty_subs:
+            self._collect_duties(snapshot, duty_subs, subject_filter, class_filter)
+
+    def covering(self, day, template):
+        """The substitution covering a template's occurrence on day, or None"""
+        if day not in self.dates:
+            return None
+        subs = self.by_slot.get((day, str(template['period']), teacher_key(template['teacher'])))
+        return _matching_substitution(subs, template) if subs else None
+
+    def _collect_duties(self, snapshot, duty_subs, subject_filter, class_filter):
+        # Week templates of the covered teachers, by (weekday, period, teacher key)
+        originals = {teacher_key(sub.original_teacher) for sub in duty_subs}
+        names = {name for name in snapshot.teachers if teacher_key(name) in originals}
+        rows = [i for i in range(len(snapshot)) if snapshot.teacher[i] in names
+                and (not subject_filter or snapshot.subject[i] == subject_filter)
+                and (not class_filter or snapshot.class_activity[i] == class_filter)]
+        slots = {}
+        for weekday, week in build_week_templates(snapshot, rows).items():
+            for template in week:
+                slots.setdefault((weekday, str(template['period']), teacher_key(template['teacher'])), []).append(template)
+        for sub in duty_subs:
+            week = slots.get((sub.date.weekday(), str(sub.period), teacher_key(sub.original_teacher)), [])
+            for template in week:
+                if _matching_substitution([sub], template):
+                    self.duties.append((sub.date.isoformat(), template, sub))
+
+def _matching_substitution(subs, template):
+    """First substitution that applies to the template's class (blank class matches any)"""
+    class_lower = template['class'].lower()
+    for sub in subs:
+        if not sub.class_activity or sub.class_activity.lower() == class_lower:
+            return sub
+    return None
+
+def iter_occurrences(templates, dates_by_weekday, overlay=None):
+    """(iso date, template, covering substitution or None) in date order.
+
+    With an overlay, the filtered teacher's substitute duties follow the
+    regular occurrences.
+    """
+    for day, weekday in dates_in_order(templates, dates_by_weekday):
+        for template in templates[weekday]:
+            yield day, template, overlay.covering(day, template) if overlay else None
+    if overlay:
+        yield from overlay.duties
+
+def iter_events(templates, dates_by_weekday, start_date, overlay=None):
+    """Stamp week templates across the occurrence dates, yielding event dicts"""
+    # Occurrences keep start_date's seconds, microseconds and UTC offset
+    time_strings = {}
+    def time_string(minutes):
+        if minutes not in time_strings:
+            time_strings[minutes] = start_date.replace(hour=minutes // 60, minute=minutes % 60).isoformat()[10:]
+        return time_strings[minutes]
+
+    for day, template, sub in iter_occurrences(templates, dates_by_weekday, overlay):
+        event = {
+            'id': f"{template['row']}_{day.replace('-', '')}",
+            'title': template['title'],
+            'start': day + time_string(template['start_min']),
+            'end': day + time_string(template['end_min']),
+            'teacher': template['teacher'],
+            'subject': template['subject'],
+            'class': template['class'],
+            'period': template['period'],
+            'day': template['day'],
+            'backgroundColor': template['color'],
+            'borderColor': template['color'],
+            'extendedProps': template['extendedProps']
+        }
+        if sub is not None:
+            color = get_color_for_teacher(sub.substitute_teacher)
+            event.update(
+                title=f"{template['title']} (sub: {sub.substitute_teacher})",
+                backgroundColor=color,
+                borderColor=color,
+                extendedProps=dict(template['extendedProps'], substitute=sub.substitute_teacher,
+                                   substituteSubject=sub.subject, substitutionId=sub.id)
             )
-            
-            # Generate events for each occurrence
-            for dt in rule:
-                # Parse time components
-                start_hour, start_min = map(int, start_time_str.split(':'))
-                end_hour, end_min = map(int, end_time_str.split(':'))
-                
-                event_start = dt.replace(hour=start_hour, minute=start_min)
-                event_end = dt.replace(hour=end_hour, minute=end_min)
-                
-                event = {
-                    'id': f"{idx}_{dt.strftime('%Y%m%d')}",
-                    'title': f"{row['Teacher Name']} - {clean_subject_name(row['Subject'])}",
-                    'start': event_start.isoformat(),
-                    'end': event_end.isoformat(),
-                    'teacher': row['Teacher Name'],
-                    'subject': clean_subject_name(row['Subject']),
-                    'class': row['Class/Activity'],
-                    'period': row['Period'],
-                    'day': row['Day'],
-                    'backgroundColor': get_color_for_teacher(row['Teacher Name']),
-                    'borderColor': get_color_for_teacher(row['Teacher Name']),
-                    'extendedProps': {
-                        'teacher': row['Teacher Name'],
-                        'subject': clean_subject_name(row['Subject']),
-                        'class': row['Class/Activity'],
-                        'period': row['Period'],
-                        'timeSlot': row['Time Slot']
-                    }
-                }
-                events.append(event)
-        
-        except Exception as e:
-            print(f"Error generating event for row {idx}: {e}")
-            continue
-    
-    # Remove duplicate events
-    unique_events = []
-    seen = set()
+        yield event
+
+COMPACT_TEMPLATE_FIELDS = ['row', 'startMinute', 'endMinute', 'teacher', 'subject', 'class',
+                           'period', 'day', 'timeSlot', 'color']
+
+def build_compact_events(templates, dates_by_weekday, start_date, overlay=None):
+    """Dictionary-encoded event payload for format=compact.
+
+    Every distinct string is stored once in `strings`. Each template is a
+    list of integers laid out as COMPACT_TEMPLATE_FIELDS, with string fields
+    given as indexes into `strings`. `events` is a flat list of
+    (template index, day offset from `base`) pairs. With an overlay,
+    `substitutions` is a flat list of (event number, substitute string,
+    subject string, color string, substitution id) for the covered occurrences.
+    decodeCompactEvents() in base.html turns this back into FullCalendar events.
+    """
+    strings = []
+    string_ids = {}
+    def ref(value):
+        value = str(value)
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    template_rows = []
+    template_ids = {}   # id(template) -> template index
+    def template_ref(template):
+        if id(template) not in template_ids:
+            props = template['extendedProps']
+            template_ids[id(template)] = len(template_rows)
+            template_rows.append([
+                template['row'], template['start_min'], template['end_min'],
+                ref(template['teacher']), ref(template['subject']), ref(template['class']),
+                ref(template['period']), ref(template['day']), ref(props['timeSlot']), ref(template['color'])
+            ])
+        return template_ids[id(template)]
+
+    for weekday in sorted(templates):
+        for template in templates[weekday]:
+            template_ref(template)
+
+    base = start_date.date()
+    offsets = {}
+    events = []
+    substitutions = []
+    for day, template, sub in iter_occurrences(templates, dates_by_weekday, overlay):
+        if day not in offsets:
+            offsets[day] = (datetime.strptime(day, '%Y-%m-%d').date() - base).days
+        if sub is not None:
+            substitutions.extend((len(events) // 2, ref(sub.substitute_teacher), ref(sub.subject),
+                                  ref(get_color_for_teacher(sub.substitute_teacher)), sub.id))
+        events.append(template_ref(template))
+        events.append(offsets[day])
+
+    payload = {
+        'base': base.isoformat(),
+        # Seconds and UTC offset shared by every start/end time, e.g. ':00+05:30'
+        'timeSuffix': start_date.replace(hour=0, minute=0).isoformat()[16:],
+        'fields': COMPACT_TEMPLATE_FIELDS,
+        'strings': strings,
+        'templates': template_rows,
+        'events': events
+    }
+    if overlay is not None:
+        payload['substitutions'] = substitutions
+    return payload
+
+def iter_event_chunks(events, output_format, chunk_size=500):
+    """Serialize an event iterator as NDJSON lines or a JSON array, in chunks"""
+    if output_format == 'ndjson':
+        prefix, separator, suffix = '', '\n', '\n'
+    else:
+        prefix, separator, suffix = '[', ',', ']\n'
+    dumps = app.json.dumps
+    yield prefix
+    chunk = []
+    wrote_any = False
     for event in events:
-        key = (
-            event['title'],
-            event['start'],
-            event['end'],
-            event.get('teacher'),
-            event.get('subject'),
-            event.get('class'),
-            event.get('period'),
-            event.get('timeSlot'),
-        )
-        if key not in seen:
-            seen.add(key)
-            unique_events.append(event)
-    
-    return unique_events
+        chunk.append(dumps(event))
+        if len(chunk) >= chunk_size:
+            yield (separator if wrote_any else '') + separator.join(chunk)
+            wrote_any = True
+            chunk = []
+    if chunk:
+        yield (separator if wrote_any else '') + separator.join(chunk)
+        wrote_any = True
+    if wrote_any or output_format != 'ndjson':
+        yield suffix
+
+def generate_rrule_events(snapshot, rows, start_date, end_date):
+    """Generate calendar events for the weekly recurring timetable entries"""
+    templates = build_week_templates(snapshot, rows)
+    if not templates:
+        return []
+    dates_by_weekday = occurrence_dates_by_weekday(start_date, end_date)
+    return list(iter_events(templates, dates_by_weekday, start_date))
+
+def substitution_overlay(snapshot, dates_by_weekday, teacher_filter, subject_filter, class_filter):
+    """SubstitutionOverlay for an /api/events request, or None if the database is unavailable"""
+    try:
+        return SubstitutionOverlay(snapshot, dates_by_weekday, teacher_filter, subject_filter, class_filter)
+    except Exception as e:
+        print('Error loading substitutions for events:', e, flush=True)
+        return None
 
 def get_color_for_teacher(teacher_name):
-    """Generate consistent color for each teacher"""
+    """Generate consistent color for each teacher, the same in every worker process"""
     colors = [
         '#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7',
         '#DDA0DD', '#98D8C8', '#F7DC6F', '#BB8FCE', '#85C1E9'
     ]
-    hash_value = hash(teacher_name) % len(colors)
+    hash_value = zlib.crc32(teacher_name.encode('utf-8')) % len(colors)
     return colors[hash_value]
 
+# Hours 0-23 and minutes 0-59 only; anything else is reported as an invalid time slot
+TIME_SLOT_PATTERN = r'^\s*([01]?\d|2[0-3]):([0-5]\d)\s+to\s+([01]?\d|2[0-3]):([0-5]\d)\s*$'
+
+def _category_lookup(values):
+    """Object array of interned strings, with '' appended for missing (code -1)"""
+    import numpy as np
+    return np.array([sys.intern(v) for v in values] + [''], dtype=object)
+
+def read_timetable_csv(source, progress=None):
+    """Read a timetable CSV into CompiledTimetable columns.
+
+    Every column is read as a categorical, so subject cleaning, day parsing
+    and time slot parsing run once per distinct value and are spread back
+    over the rows by category code. The file is read in chunks of
+    INGEST_CHUNK_ROWS; progress, if given, is called with the number of rows
+    read so far. Returns (columns, problems), where problems lists
+    'line N: ...' messages for rows with missing or unparseable values.
+    Raises ValueError if required columns are missing.
+    """
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    reader = pd.read_csv(
+        source,
+        usecols=lambda name: name in TIMETABLE_COLUMNS,
+        dtype={column: 'category' for column in TIMETABLE_COLUMNS},
+        skip_blank_lines=False,
+        chunksize=app.config['INGEST_CHUNK_ROWS']
+    )
+    chunks = {column: [] for column in TIMETABLE_COLUMNS}
+    rows_read = 0
+    for chunk in reader:
+        missing = [column for column in TIMETABLE_COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        for column in TIMETABLE_COLUMNS:
+            chunks[column].append(chunk[column])
+        rows_read += len(chunk)
+        if progress:
+            progress(rows_read)
+
+    codes = {}
+    lookups = {}
+    for column, field in zip(TIMETABLE_COLUMNS, COLUMN_FIELDS):
+        values = union_categoricals(chunks[column]) if chunks[column] else pd.Categorical([])
+        categories = values.categories.astype(str).str.strip()
+        if column == 'Subject':
+            categories = categories.str.replace(r'\d+$', '', regex=True).str.strip()
+        codes[field] = np.asarray(values.codes)
+        lookups[field] = _category_lookup(categories.tolist())
+
+    # Skipped blank lines were kept so that row index + 2 is the file line number
+    present = np.zeros(rows_read, dtype=bool)
+    for field_codes in codes.values():
+        present |= field_codes >= 0
+    line_numbers = np.flatnonzero(present) + 2
+    for field in codes:
+        codes[field] = codes[field][present]
+
+    columns = {field: lookups[field][codes[field]].tolist() for field in COLUMN_FIELDS}
+
+    # Day and time slot parsing, per category
+    day_lookup = np.array([parse_weekday(d) if d else -1 for d in lookups['day']], dtype=np.int16)
+    slot_parts = pd.Series(lookups['time_slot']).str.extract(TIME_SLOT_PATTERN).astype(float)
+    start_lookup = (slot_parts[0] * 60 + slot_parts[1]).fillna(-1).to_numpy(dtype=np.int16)
+    end_lookup = (slot_parts[2] * 60 + slot_parts[3]).fillna(-1).to_numpy(dtype=np.int16)
+    weekday = day_lookup[codes['day']]
+    start_min = start_lookup[codes['time_slot']]
+    end_min = end_lookup[codes['time_slot']]
+    columns['weekday'] = array('h', weekday.tobytes())
+    columns['start_min'] = array('h', start_min.tobytes())
+    columns['end_min'] = array('h', end_min.tobytes())
+
+    problems = []
+    checks = [
+        (codes['teacher'] < 0, 'missing Teacher Name'),
+        (weekday < 0, 'unknown Day'),
+        (codes['period_key'] < 0, 'missing Period'),
+        ((start_min < 0) | (end_min < 0), 'invalid Time Slot (expected "HH:MM to HH:MM")'),
+    ]
+    bad_rows = {}
+    for mask, message in checks:
+        for row in np.flatnonzero(mask):
+            bad_rows.setdefault(int(row), []).append(message)
+    for row in sorted(bad_rows):
+        problems.append(f"line {line_numbers[row]}: {', '.join(bad_rows[row])}")
+    return columns, problems
+
+def read_timetable_xlsx(source, progress=None):
+    """Read timetable rows straight from the teacher sheets of a workbook.
+
+    Sheets are streamed row by row into the same block parser script.py
+    uses, so the workbook goes to CompiledTimetable columns without any
+    intermediate CSV files. progress, if given, is called with the number
+    of entries read after each sheet. Returns (columns, problems) like
+    read_timetable_csv. Raises ValueError if no sheet holds a timetable.
+    """
+    # openpyxl is only needed for workbook uploads
+    from openpyxl import load_workbook
+
+    columns = {field: [] for field in COLUMN_FIELDS}
+    entry_sheets = []
+    subjects = {}
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = ([_cell_text(value) for value in row] for row in sheet.iter_rows(values_only=True))
+            for record in parse_timetable_rows(rows):
+                for column, field in zip(TIMETABLE_COLUMNS, COLUMN_FIELDS):
+                    columns[field].append(_cell_text(record[column]))
+                entry_sheets.append(sheet.title)
+            if progress:
+                progress(len(entry_sheets))
+    finally:
+        workbook.close()
+    if not entry_sheets:
+        raise ValueError('No timetable sheets found in workbook')
+
+    # Subject cleaning runs once per distinct subject
+    for i, subject in enumerate(columns['subject']):
+        if subject not in subjects:
+            subjects[subject] = sys.intern(clean_subject_name(subject))
+        columns['subject'][i] = subjects[subject]
+    columns['weekday'], columns['start_min'], columns['end_min'] = parse_day_and_time_columns(
+        columns['day'], columns['time_slot']
+    )
+
+    problems = []
+    for i, sheet_title in enumerate(entry_sheets):
+        messages = []
+        if columns['teacher'][i] == 'UNKNOWN':
+            messages.append('missing Teacher Name')
+        if columns['start_min'][i] < 0 or columns['end_min'][i] < 0:
+            messages.append('invalid Time Slot (expected "HH:MM to HH:MM")')
+        if messages:
+            problems.append(f"sheet {sheet_title}, {columns['day'][i]} period {columns['period_key'][i]}: "
+                            f"{', '.join(messages)}")
+    return columns, problems
+
+# Background timetable ingest jobs; their status is kept in the ingest_job table
+ingest_executor = ThreadPoolExecutor(max_workers=app.config['INGEST_WORKERS'], thread_name_prefix='ingest')
+
+def _update_ingest_job(job_id, **fields):
+    with app.app_context():
+        job = db.session.get(IngestJob, job_id)
+        job.state = json.dumps(dict(json.loads(job.state), **fields))
+        db.session.commit()
+
+def load_ingest_job(job_id):
+    """The job dict for job_id, or None if it is unknown or was pruned"""
+    job = db.session.get(IngestJob, job_id)
+    return None if job is None else json.loads(job.state)
+
+def submit_ingest_job(data, filename, merge=False):
+    """Queue a timetable CSV or workbook (as bytes) for parsing in the background; returns the job id.
+
+    With merge the upload is applied as a delta against the current
+    timetable instead of replacing it.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    submitted_at = datetime.now()
+    job = {
+        'id': job_id,
+        'filename': filename,
+        'mode': 'merge' if merge else 'replace',
+        'status': 'queued',
+        'rows_parsed': 0,
+        'entries': None,
+        'version': None,
+        'problems': [],
+        'diff': None,
+        'error': None,
+        'submitted_at': submitted_at.isoformat(timespec='seconds'),
+        'finished_at': None
+    }
+    db.session.add(IngestJob(id=job_id, submitted_at=submitted_at, state=json.dumps(job)))
+    # Keep only the newest INGEST_JOBS_KEPT jobs
+    stale = db.session.query(IngestJob.id).order_by(IngestJob.submitted_at.desc()).offset(app.config['INGEST_JOBS_KEPT'])
+    IngestJob.query.filter(IngestJob.id.in_(stale.scalar_subquery())).delete(synchronize_session=False)
+    db.session.commit()
+    ingest_executor.submit(_run_ingest_job, job_id, data, filename, merge)
+    return job_id
+
+def _run_ingest_job(job_id, data, filename, merge=False):
+    """Parse an uploaded timetable and publish it; the swap is atomic, so readers
+    keep using the previous snapshot until this one is complete"""
+    try:
+        _update_ingest_job(job_id, status='running')
+        reader = read_timetable_xlsx if filename.lower().endswith('.xlsx') else read_timetable_csv
+        columns, problems = reader(
+            io.BytesIO(data), progress=lambda rows: _update_ingest_job(job_id, rows_parsed=rows)
+        )
+        _update_ingest_job(job_id, status='publishing', rows_parsed=len(columns['teacher']), problems=problems)
+        with app.app_context():
+            if merge:
+                snapshot, diff = merge_timetable(columns)
+            else:
+                snapshot, diff = replace_timetable(columns), None
+        _update_ingest_job(job_id, status='done', entries=len(snapshot), version=snapshot.version, diff=diff,
+                           finished_at=datetime.now().isoformat(timespec='seconds'))
+    except Exception as e:
+        _update_ingest_job(job_id, status='failed', error=str(e),
+                           finished_at=datetime.now().isoformat(timespec='seconds'))
+
 @app.route('/')
 def index():
     return render_template('index.html', 
                          teachers_count=len(teachers_data),
-                         timetable_count=len(timetable_data))
+                         timetable_count=len(timetable_snapshot))
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_files():
@@ -224,9 +1922,10 @@ def upload_files():
             teachers_file = request.files['teachers_file']
             if teachers_file and allowed_file(teachers_file.filename):
                 try:
+                    import pandas as pd
                     df = pd.read_csv(teachers_file)
-                    global teachers_data
-                    teachers_data = df.to_dict('records')
+                    # Round trip through JSON for plain Python values (NaN -> None)
+                    set_teachers(json.loads(df.to_json(orient='records')))
                     flash(f'Teachers list uploaded successfully! ({len(teachers_data)} teachers)', 'success')
                 except Exception as e:
                     flash(f'Error uploading teachers file: {str(e)}', 'error')
@@ -234,52 +1933,52 @@ def upload_files():
         # Handle timetable upload
         if 'timetable_file' in request.files:
             timetable_file = request.files['timetable_file']
-            if timetable_file and allowed_file(timetable_file.filename):
+            if timetable_file and allowed_file(timetable_file.filename, TIMETABLE_EXTENSIONS):
                 try:
-                    df = pd.read_csv(timetable_file)
-                    # Clean subject names
-                    df['Subject'] = df['Subject'].apply(clean_subject_name)
-                    global timetable_data
-                    timetable_data = df.to_dict('records')
-                    flash(f'Timetable uploaded successfully! ({len(timetable_data)} entries)', 'success')
+                    # Parse in the background so large files don't tie up this worker
+                    job_id = submit_ingest_job(timetable_file.read(), timetable_file.filename,
+                                               merge=request.form.get('merge') == 'on')
+                    flash('Timetable upload received, processing in the background.', 'success')
+                    return redirect(url_for('upload_files', job=job_id))
                 except Exception as e:
                     flash(f'Error uploading timetable file: {str(e)}', 'error')
         
         return redirect(url_for('upload_files'))
     
-    return render_template('upload.html')
+    return render_template('upload.html', job_id=request.args.get('job'))
+
+@app.route('/api/ingest_jobs/<job_id>')
+def get_ingest_job(job_id):
+    job = load_ingest_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown ingest job'}), 404
+    return jsonify(job)
 
 @app.route('/timetable')
 def view_timetable():
-    if not timetable_data:
+    if not timetable_snapshot:
         flash('No timetable data available. Please upload timetable CSV first.', 'warning')
         return redirect(url_for('upload_files'))
     
     # Get unique values for filters
-    df = pd.DataFrame(timetable_data)
-    teachers = sorted([t for t in df['Teacher Name'].dropna().unique() if isinstance(t, str)])
-    subjects = sorted(df['Subject'].unique())
-    classes = sorted(df['Class/Activity'].unique())
+    snapshot = timetable_snapshot
+    teachers = snapshot.teachers
+    subjects = snapshot.subjects
+    classes = snapshot.classes
     
-    # Detect clashes
-    clashes = detect_clashes(df)
+    # Clashes come straight from the incrementally maintained index
+    clashes = snapshot.clash_index.clashes(snapshot)
 
-    # Compute teacher stats for dropdown
-    from collections import Counter
-    teacher_stats = {t: {'absent': 0, 'substitute': 0} for t in teachers}
+    # Teacher stats for dropdown, from the counters table
     try:
-        
-        from python_flask_time_table.app import db
-        all_subs = Substitution.query.all()
-        for t in teachers:
-            teacher_stats[t]['absent'] = sum(1 for s in all_subs if s.original_teacher == t)
-            teacher_stats[t]['substitute'] = sum(1 for s in all_subs if s.substitute_teacher == t)
+        teacher_stats = get_teacher_stats(teachers)
     except Exception:
         # fallback if db not available
-        pass
+        teacher_stats = {t: {'absent': 0, 'substitute': 0} for t in teachers}
 
+    # Rows are loaded page by page from /api/timetable
     return render_template('timetable.html', 
-                         timetable=timetable_data,
+                         timetable_count=len(snapshot),
                          teachers=teachers,
                          subjects=subjects,
                          classes=classes,
@@ -288,16 +1987,16 @@ def view_timetable():
 
 @app.route('/calendar')
 def calendar_view():
-    if not timetable_data:
+    if not timetable_snapshot:
         flash('No timetable data available. Please upload timetable CSV first.', 'warning')
         return redirect(url_for('upload_files'))
     
     # Get unique values for filters
-    df = pd.DataFrame(timetable_data)
-    teachers = sorted([t for t in df['Teacher Name'].dropna().unique() if isinstance(t, str)])
-    subjects = sorted([s for s in df['Subject'].dropna().unique() if isinstance(s, str)])
-    classes = sorted([c for c in df['Class/Activity'].dropna().unique() if isinstance(c, str)])
-    periods = sorted([p for p in df['Period'].dropna().unique() if str(p).isdigit()])
+    snapshot = timetable_snapshot
+    teachers = snapshot.teachers
+    subjects = snapshot.subjects
+    classes = snapshot.classes
+    periods = snapshot.periods
     
     return render_template('calendar.html',
                          teachers=teachers,
@@ -308,32 +2007,22 @@ def calendar_view():
 @app.route('/substitute_handling')
 def substitute_handling_view():
     print('substitute_handling_view called', flush=True)
-    if not timetable_data:
+    if not timetable_snapshot:
         flash('No timetable data available. Please upload timetable CSV first.', 'warning')
         return redirect(url_for('upload_files'))
     
-    df = pd.DataFrame(timetable_data)
-    teachers = sorted([t for t in df['Teacher Name'].dropna().unique() if isinstance(t, str)])
-    subjects = sorted([s for s in df['Subject'].dropna().unique() if isinstance(s, str)])
-    classes = sorted([c for c in df['Class/Activity'].dropna().unique() if isinstance(c, str)])
-    periods = sorted([p for p in df['Period'].dropna().unique() if str(p).isdigit()])
-
-    # Compute teacher stats for dropdown
-    teacher_stats = {t: {'absent': 0, 'substitute': 0} for t in teachers}
+    snapshot = timetable_snapshot
+    teachers = snapshot.teachers
+    subjects = snapshot.subjects
+    classes = snapshot.classes
+    periods = snapshot.periods
+
+    # Teacher stats for dropdown, from the counters table
     try:
-        
-        all_subs = Substitution.query.all()
-        print('Saved substitutions:', [(s.original_teacher, s.substitute_teacher, s.subject) for s in all_subs], flush=True)
-        # Build a mapping of cleaned teacher names to original names
-        teacher_clean_map = {t.strip().lower(): t for t in teachers}
-        for t in teachers:
-            t_clean = t.strip().lower()
-            teacher_stats[t]['absent'] = sum(1 for s in all_subs if s.original_teacher and s.original_teacher.strip().lower() == t_clean)
-            teacher_stats[t]['substitute'] = sum(1 for s in all_subs if s.substitute_teacher and s.substitute_teacher.strip().lower() == t_clean)
-        print('Computed teacher_stats:', teacher_stats, flush=True)
+        teacher_stats = get_teacher_stats(teachers)
     except Exception as e:
         print('Error calculating teacher stats:', e, flush=True)
-        pass
+        teacher_stats = {t: {'absent': 0, 'substitute': 0} for t in teachers}
 
     return render_template('substitute_handling.html',
                          teachers=teachers,
@@ -342,49 +2031,111 @@ def substitute_handling_view():
                          periods=periods,
                          teacher_stats=teacher_stats)
 
+def invalidate_substitution_events():
+    """Drop cached /api/events payloads that overlay substitutions"""
+    events_cache.invalidate(lambda key: key[6])
+
+def events_key_affected(cache_key, affected):
+    """Whether a cached /api/events payload can include rows with the affected values.
+
+    A teacher's payload with substitutions overlaid also holds the lessons
+    they cover for others, so any timetable change may affect it.
+    """
+    teacher_filter, subject_filter, class_filter = cache_key[:3]
+    if teacher_filter and cache_key[6]:
+        return True
+    return ((not teacher_filter or teacher_filter in affected['teacher'])
+            and (not subject_filter or subject_filter in affected['subject'])
+            and (not class_filter or class_filter in affected['class']))
+
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'stream': 'application/json'}
+
 @app.route('/api/events')
 def get_events():
-    if not timetable_data:
-        return jsonify([])
-    
     # Get query parameters for filtering
     teacher_filter = request.args.get('teacher', '')
     subject_filter = request.args.get('subject', '')
     class_filter = request.args.get('class', '')
     start_date = request.args.get('start', '')
     end_date = request.args.get('end', '')
+    output_format = request.args.get('format', '')
+    # substitutions=1 overlays recorded substitutions on the occurrences
+    with_substitutions = request.args.get('substitutions', '').lower() in ('1', 'true', 'yes')
+
+    # Read the cache generation before the snapshot so a concurrent
+    # invalidation can't leave a stale payload cached
+    generation = events_cache.generation
+    if not timetable_snapshot:
+        if output_format == 'ndjson':
+            return app.response_class('', mimetype=STREAM_MIMETYPES['ndjson'])
+        return jsonify([])
     
-    # Create DataFrame
-    df = pd.DataFrame(timetable_data)
-    
-    # Apply filters
-    if teacher_filter:
-        df = df[df['Teacher Name'] == teacher_filter]
-    if subject_filter:
-        df = df[df['Subject'] == subject_filter]
-    if class_filter:
-        df = df[df['Class/Activity'] == class_filter]
+    snapshot = timetable_snapshot
     
     # Parse date range
+    cacheable = bool(start_date and end_date)
     try:
         start_dt = datetime.fromisoformat(start_date.replace('Z', '')) if start_date else datetime.now()
         end_dt = datetime.fromisoformat(end_date.replace('Z', '')) if end_date else (datetime.now() + timedelta(days=30))
     except:
+        # The fallback range moves with the clock, so don't cache it
+        cacheable = False
         start_dt = datetime.now()
         end_dt = datetime.now() + timedelta(days=30)
     
-    # Generate events using RRULE
-    events = generate_rrule_events(df, start_dt, end_dt)
+    # Streaming formats expand lazily so memory stays flat with range size
+    if output_format in STREAM_MIMETYPES:
+        rows = snapshot.select(teacher_filter, subject_filter, class_filter)
+        templates = build_week_templates(snapshot, rows)
+        dates_by_weekday = occurrence_dates_by_weekday(start_dt, end_dt) if templates or with_substitutions else {}
+        overlay = substitution_overlay(snapshot, dates_by_weekday, teacher_filter, subject_filter,
+                                       class_filter) if with_substitutions else None
+        events = iter_events(templates, dates_by_weekday, start_dt, overlay)
+        return app.response_class(iter_event_chunks(events, output_format),
+                                  mimetype=STREAM_MIMETYPES[output_format])
+
+    # Serve repeat requests for the same filters and range from the cache
+    compact = output_format == 'compact'
+    cache_key = (teacher_filter, subject_filter, class_filter,
+                 start_dt.isoformat(), end_dt.isoformat(), compact, with_substitutions)
+    entry = events_cache.get(cache_key) if cacheable else None
+    if entry is None:
+        # Apply filters on the compiled snapshot and expand the weekly events
+        rows = snapshot.select(teacher_filter, subject_filter, class_filter)
+        if compact or with_substitutions:
+            templates = build_week_templates(snapshot, rows)
+            dates_by_weekday = occurrence_dates_by_weekday(start_dt, end_dt) if templates or with_substitutions else {}
+            overlay = substitution_overlay(snapshot, dates_by_weekday, teacher_filter, subject_filter,
+                                           class_filter) if with_substitutions else None
+            if compact:
+                events = build_compact_events(templates, dates_by_weekday, start_dt, overlay)
+            else:
+                events = list(iter_events(templates, dates_by_weekday, start_dt, overlay))
+        else:
+            events = generate_rrule_events(snapshot, rows, start_dt, end_dt)
+        payload = (app.json.dumps(events) + '\n').encode('utf-8')
+        entry = events_cache.put(cache_key, payload, generation) if cacheable else (payload, hashlib.sha1(payload).hexdigest())
     
-    return jsonify(events)
+    payload, etag = entry
+    response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/clashes')
 def get_clashes():
-    if not timetable_data:
+    if not timetable_snapshot:
         return jsonify([])
     
-    df = pd.DataFrame(timetable_data)
-    clashes = detect_clashes(df)
+    # mode=period compares period labels; mode=interval compares time slot overlap
+    mode = request.args.get('mode', 'period')
+    if mode == 'interval':
+        clashes = detect_interval_clashes(timetable_snapshot)
+    elif mode == 'period':
+        snapshot = timetable_snapshot
+        clashes = snapshot.clash_index.clashes(snapshot)
+    else:
+        return jsonify({'error': f'Unknown clash mode: {mode}'}), 400
     return jsonify(clashes)
 
 @app.route('/edit_timetable', methods=['GET', 'POST'])
@@ -393,6 +2144,7 @@ def edit_timetable():
         try:
             # Get form data
             entry_id = int(request.form.get('entry_id'))
+            version = request.form.get('version', type=int)
             teacher_name = request.form.get('teacher_name')
             subject = request.form.get('subject')
             day = request.form.get('day')
@@ -400,16 +2152,16 @@ def edit_timetable():
             time_slot = request.form.get('time_slot')
             class_activity = request.form.get('class_activity')
             
-            # Update the timetable data
-            if 0 <= entry_id < len(timetable_data):
-                timetable_data[entry_id].update({
+            # Update the timetable data; entry_id is the row's stable id
+            if timetable_snapshot.position(entry_id) is not None:
+                edit_timetable_rows({entry_id: {
                     'Teacher Name': teacher_name,
                     'Subject': subject,
                     'Day': day,
                     'Period': period,
                     'Time Slot': time_slot,
                     'Class/Activity': class_activity
-                })
+                }}, version)
                 flash('Timetable entry updated successfully!', 'success')
             else:
                 flash('Invalid entry ID', 'error')
@@ -421,153 +2173,303 @@ def edit_timetable():
     
     # GET request - show edit form
     entry_id = request.args.get('id', type=int)
-    if entry_id is None or entry_id >= len(timetable_data):
+    snapshot = timetable_snapshot
+    position = None if entry_id is None else snapshot.position(entry_id)
+    if position is None:
         flash('Invalid entry ID', 'error')
         return redirect(url_for('view_timetable'))
     
-    entry = timetable_data[entry_id]
-    return render_template('edit_timetable.html', entry=entry, entry_id=entry_id)
+    entry = snapshot.record(position)
+    return render_template('edit_timetable.html', entry=entry, entry_id=entry_id, version=snapshot.version)
+
+# JSON field name -> timetable CSV column, for row edits
+EDITABLE_FIELDS = {
+    'teacher_name': 'Teacher Name',
+    'subject': 'Subject',
+    'day': 'Day',
+    'period': 'Period',
+    'time_slot': 'Time Slot',
+    'class_activity': 'Class/Activity'
+}
+
+def validate_row_changes(snapshot, items):
+    """Check a batch of row edits against the current timetable.
+
+    Each item is {"id": row id, <EDITABLE_FIELDS>...}. Returns (changes,
+    errors): changes maps row id -> CSV-style dict of new values, errors
+    lists {index, errors} for every invalid item.
+    """
+    changes, errors, seen = {}, [], set()
+    for index, item in enumerate(items):
+        problems = []
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'errors': ['Expected an object']})
+            continue
+        row_id = item.get('id')
+        if not isinstance(row_id, int) or isinstance(row_id, bool) or snapshot.position(row_id) is None:
+            problems.append(f'Unknown row id: {row_id}')
+        elif row_id in seen:
+            problems.append(f'Row {row_id} is changed more than once in this batch')
+        else:
+            seen.add(row_id)
+        fields = {}
+        for name, value in item.items():
+            if name == 'id':
+                continue
+            if name not in EDITABLE_FIELDS:
+                problems.append(f'Unknown field: {name}')
+            elif not isinstance(value, (str, int)) or isinstance(value, bool):
+                problems.append(f'{name} must be a string')
+            else:
+                fields[EDITABLE_FIELDS[name]] = _cell_text(value)
+        if not fields and not problems:
+            problems.append('No fields to change')
+        for name in ('teacher_name', 'day', 'period'):
+            if fields.get(EDITABLE_FIELDS[name]) == '':
+                problems.append(f'{name} cannot be empty')
+        if fields.get('Day') and parse_weekday(fields['Day']) < 0:
+            problems.append(f"Invalid day: {fields['Day']}")
+        if 'Time Slot' in fields:
+            start, end = parse_time_slot(fields['Time Slot'])
+            if not (start and end) or -1 in (time_to_minutes(start), time_to_minutes(end)):
+                problems.append('Invalid time_slot (expected "HH:MM to HH:MM")')
+        if problems:
+            errors.append({'index': index, 'errors': problems})
+        else:
+            changes[row_id] = fields
+    return changes, errors
+
+def timetable_cursor(key):
+    """Keyset pagination token for the position just after the row with this sort key"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+@app.route('/api/timetable', methods=['GET'])
+def get_timetable():
+    """Timetable rows filtered, sorted and paginated by keyset on the server.
+
+    Query params: teacher, subject, class (exact), day (any label of the
+    weekday), sort (one of TIMETABLE_SORTS, default day), order (asc or
+    desc), limit (default 100, max 1000) and after (the 'next' token of the
+    previous page). Rows are ordered by the sort field, then day, period and
+    row id; filters use per-column indexes, so a page costs about the size
+    of the filtered rows rather than of the timetable.
+    """
+    snapshot = timetable_snapshot
+    sort = request.args.get('sort', 'day')
+    descending = request.args.get('order', 'asc') == 'desc'
+    if sort not in TIMETABLE_SORTS:
+        return jsonify({'error': f'Unknown sort: {sort}'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        after = None
+        if request.args.get('after'):
+            after = tuple(json.loads(base64.urlsafe_b64decode(request.args['after'].encode('ascii'))))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or after parameter'}), 400
+
+    candidates = []
+    for param, field in (('teacher', 'teacher'), ('subject', 'subject'), ('class', 'class_activity')):
+        if request.args.get(param):
+            candidates.append(snapshot.column_index(field).get(request.args[param].strip(), ()))
+    if request.args.get('day'):
+        day = request.args['day'].strip()
+        weekday = parse_weekday(day)
+        if weekday >= 0:
+            candidates.append(snapshot.column_index('weekday').get(weekday, ()))
+        else:
+            candidates.append(snapshot.column_index('day').get(day, ()))
+
+    sort_key = lambda i: timetable_sort_key(snapshot, sort, i)
+    if candidates:
+        candidates.sort(key=len)
+        rows = set(candidates[0]).intersection(*candidates[1:])
+        rows = sorted(rows, key=sort_key)
+    else:
+        rows = snapshot.sorted_rows(sort)
+    try:
+        if descending:
+            end = len(rows) if after is None else bisect.bisect_left(rows, after, key=sort_key)
+            page = rows[max(end - limit, 0):end][::-1]
+            has_more = end > limit
+        else:
+            start = 0 if after is None else bisect.bisect_right(rows, after, key=sort_key)
+            page = rows[start:start + limit]
+            has_more = start + limit < len(rows)
+    except TypeError:
+        return jsonify({'error': 'Invalid after parameter'}), 400
+
+    return jsonify({
+        'rows': [{
+            'id': snapshot.row_id[i],
+            'teacher_name': snapshot.teacher[i],
+            'subject': snapshot.subject[i],
+            'day': snapshot.day[i],
+            'period': snapshot.period[i],
+            'time_slot': snapshot.time_slot[i],
+            'class_activity': snapshot.class_activity[i]
+        } for i in page],
+        'total': len(rows),
+        'version': snapshot.version,
+        'next': timetable_cursor(sort_key(page[-1])) if page and has_more else None
+    })
+
+@app.route('/api/timetable', methods=['PATCH'])
+def patch_timetable():
+    """Edit a batch of timetable rows, addressed by stable row id, all or nothing.
+
+    Accepts {"changes": [{"id": ..., "teacher_name": ..., ...}], "version": n}
+    or a bare list. The version the ids were read at can be given as
+    "version" or an If-Match header; if the timetable has moved on since,
+    nothing is applied and 409 is returned. The batch is validated as a
+    whole and published as one snapshot. Returns the new version and the
+    clashes added, resolved and changed.
+    """
+    data = request.get_json(silent=True)
+    expected_version = None
+    if isinstance(data, dict):
+        expected_version = data.get('version')
+        data = data.get('changes')
+    if expected_version is None and request.headers.get('If-Match'):
+        expected_version = request.headers['If-Match'].removeprefix('W/').strip('"')
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Expected a non-empty list of changes'}), 400
+    if expected_version is not None:
+        try:
+            expected_version = int(expected_version)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid version'}), 400
+        if expected_version != timetable_snapshot.version:
+            return jsonify({'error': f'The timetable is at version {timetable_snapshot.version}, '
+                                     f'not {expected_version}; reload and try again',
+                            'version': timetable_snapshot.version}), 409
+
+    changes, errors = validate_row_changes(timetable_snapshot, data)
+    if errors:
+        return jsonify({'error': 'No changes applied: some changes are invalid', 'results': errors}), 400
+    try:
+        snapshot, delta = edit_timetable_rows(changes, expected_version)
+    except KeyError as e:
+        # A row was removed by an upload since validation
+        return jsonify({'error': e.args[0]}), 409
+    except TimetableVersionConflict as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'version': snapshot.version, 'updated': len(changes), 'clashes': delta})
 
 @app.route('/generate_rrule')
 def generate_rrule():
     """Generate RRULE strings for timetable entries"""
-    if not timetable_data:
+    if not timetable_snapshot:
         return jsonify({'error': 'No timetable data available'})
     
-    df = pd.DataFrame(timetable_data)
-    df = df.fillna('')  # <-- Add this line to replace NaN with empty string
+    snapshot = timetable_snapshot
     rrule_data = []
     
-    for idx, row in df.iterrows():
-        day_name = str(row['Day']).lower()
+    for idx in range(len(snapshot)):
+        weekday = snapshot.weekday[idx]
         
-        # Map day to RRULE format
-        rrule_day = None
-        for key, value in DAY_MAPPING.items():
-            if day_name.startswith(key):
-                rrule_day = key.upper()[:2]  # Convert to MO, TU, WE, etc.
-                break
-        
-        if rrule_day:
+        if weekday >= 0:
             # Generate RRULE string
-            rrule_string = f"RRULE:FREQ=WEEKLY;BYDAY={rrule_day}"
+            rrule_string = f"RRULE:FREQ=WEEKLY;BYDAY={WEEKDAY_CODES[weekday]}"
             
             rrule_entry = {
-                'teacher': row['Teacher Name'],
-                'subject': clean_subject_name(row['Subject']),
-                'class': row['Class/Activity'],
-                'day': row['Day'],
-                'period': row['Period'],
-                'time_slot': row['Time Slot'],
+                'teacher': snapshot.teacher[idx],
+                'subject': clean_subject_name(snapshot.subject[idx]),
+                'class': snapshot.class_activity[idx],
+                'day': snapshot.day[idx],
+                'period': snapshot.period[idx],
+                'time_slot': snapshot.time_slot[idx],
                 'rrule': rrule_string
             }
             rrule_data.append(rrule_entry)
     
     return jsonify(rrule_data)
 
+def normalize_filter_values(value):
+    """Lowercased filter values from a comma separated string or a list"""
+    if not value:
+        return frozenset()
+    if isinstance(value, str):
+        value = value.split(',')
+    return frozenset(str(v).strip().lower() for v in value if str(v).strip())
+
 @app.route('/api/free_teachers')
 def get_free_teachers():
     date_str = request.args.get('date')
     period = request.args.get('period')
+    periods_param = request.args.get('periods')
     subject_param = request.args.get('subject', None)
     class_param = request.args.get('class', None)
 
-    if not timetable_data:
+    if not timetable_snapshot:
         return jsonify({'error': 'No timetable data available. Please upload timetable CSV first.'}), 400
 
-    if not date_str or not period:
+    if not date_str or not (period or periods_param):
         return jsonify({'error': 'Missing date or period'}), 400
 
     try:
-        selected_date = datetime.strptime(date_str, "%Y-%m-%d")
-        weekday_short = selected_date.strftime("%a").capitalize()  # e.g., 'Tue'
+        weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
 
-        # Normalize subject filter
-        if subject_param:
-            selected_subjects = [s.strip() for s in subject_param.split(',') if s.strip()]
-            selected_subjects_normalized = set(s.strip().lower() for s in selected_subjects)
-        else:
-            selected_subjects_normalized = set()
+        # Normalize subject (partial match) and class filters
+        selected_subjects_normalized = normalize_filter_values(subject_param)
+        selected_classes_normalized = normalize_filter_values(class_param)
+        occupancy = timetable_snapshot.occupancy
 
-        # Normalize class filter
-        if class_param:
-            selected_classes = [c.strip() for c in class_param.split(',') if c.strip()]
-            selected_classes_normalized = set(c.strip().lower() for c in selected_classes)
-        else:
-            selected_classes_normalized = set()
-
-        # 1. Teachers who teach selected subject(s) (allow partial match)
-        if selected_subjects_normalized:
-            subject_teachers = set(
-                t['Teacher Name'] for t in timetable_data
-                if isinstance(t.get('Teacher Name'), str)
-                and t.get('Teacher Name').strip()
-                and any(
-                    subj in str(t.get('Subject', '')).strip().lower()
-                    for subj in selected_subjects_normalized
-                )
+        # Batch mode: periods=1,2,5 answers every period in one pass, keyed by period
+        if periods_param:
+            period_keys = [p.strip() for p in periods_param.split(',') if p.strip()]
+            free_by_period = occupancy.free_teachers_by_period(
+                weekday, period_keys, selected_subjects_normalized, selected_classes_normalized
             )
-        else:
-            subject_teachers = set(
-                t['Teacher Name'] for t in timetable_data
-                if isinstance(t.get('Teacher Name'), str) and t.get('Teacher Name').strip()
-            )
-
-        # 2. Teachers who teach selected class(es)
-        if selected_classes_normalized:
-            class_teachers = set(
-                t['Teacher Name'] for t in timetable_data
-                if isinstance(t.get('Teacher Name'), str)
-                and t.get('Teacher Name').strip()
-                and str(t.get('Class/Activity', '')).strip().lower() in selected_classes_normalized
-            )
-        else:
-            class_teachers = set(
-                t['Teacher Name'] for t in timetable_data
-                if isinstance(t.get('Teacher Name'), str) and t.get('Teacher Name').strip()
-            )
-
-        # Combine filters: Teachers who match both subject and class
-        filtered_teachers = subject_teachers & class_teachers
+            return jsonify({'periods': free_by_period})
 
-        # 3. Busy teachers on selected day and period
-        busy_teachers = set(
-            t['Teacher Name'] for t in timetable_data
-            if isinstance(t.get('Teacher Name'), str)
-            and t.get('Teacher Name').strip()
-            and str(t.get('Day', '')).strip() == weekday_short
-            and str(t.get('Period', '')).strip() == period
+        # Teachers matching the subject and class filters who have no lesson in this slot
+        free_teacher_subjects = occupancy.free_teacher_subjects(
+            weekday, period.strip(), selected_subjects_normalized, selected_classes_normalized
         )
-
-        # 4. Final: Free teachers who match subject and class filters
-        free_teachers = sorted(list(filtered_teachers - busy_teachers))
-
-        free_teacher_subjects = []
-        for teacher in sorted(filtered_teachers - busy_teachers):
-            # Find all matching subjects this teacher teaches (from selected_subjects, partial match)
-            matching_subjects = set(
-                str(t.get('Subject', '')).strip()
-                for t in timetable_data
-                if t.get('Teacher Name') == teacher
-                and (
-                    not selected_subjects_normalized or
-                    any(subj in str(t.get('Subject', '')).strip().lower() for subj in selected_subjects_normalized)
-                )
-            )
-            for subj in matching_subjects:
-                free_teacher_subjects.append({'name': teacher, 'subject': subj})
-        print("Selected subjects:", selected_subjects_normalized)
-        print("Filtered teachers (teach selected subjects):", filtered_teachers)
-        print("Busy teachers:", busy_teachers)
-        print("Free teachers:", filtered_teachers - busy_teachers)
-        print("Free teacher-subjects:", free_teacher_subjects)
         return jsonify({'free_teachers': free_teacher_subjects})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
-    
-    
+
+@app.route('/api/free_teachers', methods=['POST'])
+def get_free_teachers_batch():
+    """Answer several (date, period, subject, class) queries in one request.
+
+    Accepts {"queries": [...]} or a bare list. Queries that share a date and
+    filters are answered together; results come back in request order.
+    """
+    if not timetable_snapshot:
+        return jsonify({'error': 'No timetable data available. Please upload timetable CSV first.'}), 400
+
+    data = request.get_json(silent=True)
+    queries = data.get('queries') if isinstance(data, dict) else data
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'Expected a non-empty list of queries'}), 400
+
+    occupancy = timetable_snapshot.occupancy
+    groups = {}
+    for position, query in enumerate(queries):
+        if not isinstance(query, dict) or not query.get('date') or query.get('period') in (None, ''):
+            return jsonify({'error': f'Query {position} is missing date or period'}), 400
+        try:
+            weekday = datetime.strptime(query['date'], "%Y-%m-%d").weekday()
+        except (TypeError, ValueError):
+            return jsonify({'error': f"Query {position} has an invalid date: {query['date']}"}), 400
+        key = (weekday, normalize_filter_values(query.get('subject')), normalize_filter_values(query.get('class')))
+        groups.setdefault(key, []).append(position)
+
+    results = [None] * len(queries)
+    for (weekday, subjects_lower, classes_lower), positions in groups.items():
+        period_keys = [str(queries[p]['period']).strip() for p in positions]
+        free_by_period = occupancy.free_teachers_by_period(weekday, period_keys, subjects_lower, classes_lower)
+        for p, period_key in zip(positions, period_keys):
+            results[p] = {
+                'date': queries[p]['date'],
+                'period': period_key,
+                'free_teachers': free_by_period[period_key]
+            }
+    return jsonify({'results': results})
+
 @app.route('/api/teacher_periods')
 def get_teacher_periods():
     teacher = request.args.get('teacher')
@@ -576,16 +2478,8 @@ def get_teacher_periods():
         return jsonify({'periods': []})
 
     try:
-        selected_date = datetime.strptime(date_str, "%Y-%m-%d")
-        weekday_short = selected_date.strftime("%a").capitalize()  # e.g., 'Mon'
-
-        periods = sorted(set(
-            str(row['Period']).strip()
-            for row in timetable_data
-            if str(row.get('Day', '')).strip() == weekday_short
-            and row.get('Teacher Name') == teacher
-            and row.get('Period') is not None
-        ), key=lambda x: int(x) if x.isdigit() else x)
+        weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
+        periods = timetable_snapshot.occupancy.teacher_periods(teacher, weekday)
 
         return jsonify({'periods': periods})
     except Exception as e:
@@ -593,38 +2487,413 @@ def get_teacher_periods():
 
 @app.route('/api/substitutions', methods=['POST'])
 def save_substitution():
-    data = request.get_json()
+    data = request.get_json(silent=True)
     required_fields = ['date', 'period', 'class_activity', 'original_teacher', 'substitute_teacher', 'subject']
-    if not all(field in data for field in required_fields):
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
+    try:
+        substitution_date = datetime.strptime(str(data['date']), '%Y-%m-%d').date()
+        period = int(data['period'])
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid date or period. Use YYYY-MM-DD and a period number'}), 400
     substitution = Substitution(
-        date=data['date'],
-        period=data['period'],
+        date=substitution_date,
+        period=period,
         class_activity=data['class_activity'],
         original_teacher=data['original_teacher'],
         substitute_teacher=data['substitute_teacher'],
         subject=data['subject']
     )
-    db.session.add(substitution)
-    db.session.commit()
+    try:
+        db.session.add(substitution)
+        record_substitution_stats([(substitution.original_teacher, substitution.substitute_teacher)])
+        bump_substitution_version()
+        db.session.commit()
+    except db.exc.IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f"{substitution.substitute_teacher} is already substituting in period {period} "
+                                 f"on {substitution_date.isoformat()}"}), 409
+    invalidate_substitution_events()
     return jsonify({'message': 'Substitution saved successfully'}), 201
 
+def validate_substitutions(items):
+    """Check a batch of substitution dicts against the timetable, the saved
+    substitutions for the same dates and each other.
+
+    Saved substitutions are loaded with one query over the batch's dates.
+    Returns a list with, per item, either a Substitution ready to add or a
+    list of error messages.
+    """
+    required_fields = ['date', 'period', 'class_activity', 'original_teacher', 'substitute_teacher', 'subject']
+    snapshot = timetable_snapshot
+    occupancy = snapshot.occupancy
+    names = {teacher_key(name): name for name in snapshot.teachers}
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or not all(field in item for field in required_fields):
+            parsed.append(['Missing required fields'])
+            continue
+        try:
+            substitution_date = datetime.strptime(str(item['date']), '%Y-%m-%d').date()
+            period = int(item['period'])
+        except (ValueError, TypeError):
+            parsed.append(['Invalid date or period. Use YYYY-MM-DD and a period number'])
+            continue
+        parsed.append(Substitution(
+            date=substitution_date,
+            period=period,
+            class_activity=str(item['class_activity']).strip(),
+            original_teacher=str(item['original_teacher']).strip(),
+            substitute_teacher=str(item['substitute_teacher']).strip(),
+            subject=str(item['subject']).strip()
+        ))
+
+    # Who is already covering or absent, and which classes are covered, per (date, period)
+    dates = {s.date for s in parsed if isinstance(s, Substitution)}
+    covering, absent, covered = set(), set(), set()
+    def claim(s):
+        covering.add((s.date, s.period, teacher_key(s.substitute_teacher)))
+        absent.add((s.date, s.period, teacher_key(s.original_teacher)))
+        if s.class_activity:
+            covered.add((s.date, s.period, s.class_activity.lower()))
+    if dates:
+        for saved in Substitution.query.filter(Substitution.date.in_(dates)):
+            claim(saved)
+
+    results = []
+    for s in parsed:
+        if not isinstance(s, Substitution):
+            results.append(s)
+            continue
+        errors = []
+        weekday = s.date.weekday()
+        slot = (s.date, s.period)
+        if teacher_key(s.original_teacher) == teacher_key(s.substitute_teacher):
+            errors.append('Substitute is the absent teacher')
+        original = names.get(teacher_key(s.original_teacher))
+        substitute = names.get(teacher_key(s.substitute_teacher))
+        if original is None:
+            errors.append(f'Unknown absent teacher {s.original_teacher}')
+        elif not occupancy.is_busy(original, weekday, s.period):
+            errors.append(f'{s.original_teacher} has no lesson in period {s.period} on {s.date.isoformat()}')
+        if substitute is None:
+            errors.append(f'Unknown substitute teacher {s.substitute_teacher}')
+        elif occupancy.is_busy(substitute, weekday, s.period):
+            errors.append(f'{s.substitute_teacher} teaches in period {s.period} on {s.date.isoformat()}')
+        if slot + (teacher_key(s.substitute_teacher),) in covering:
+            errors.append(f'{s.substitute_teacher} is already substituting in period {s.period} on {s.date.isoformat()}')
+        if slot + (teacher_key(s.substitute_teacher),) in absent:
+            errors.append(f'{s.substitute_teacher} is absent in period {s.period} on {s.date.isoformat()}')
+        if s.class_activity and slot + (s.class_activity.lower(),) in covered:
+            errors.append(f'{s.class_activity} already has a substitute in period {s.period} on {s.date.isoformat()}')
+        if errors:
+            results.append(errors)
+        else:
+            # Later items in the batch see this one as taken
+            claim(s)
+            results.append(s)
+    return results
+
+def min_cost_assignment(cost):
+    """Hungarian algorithm for a rectangular cost matrix with rows <= columns.
+
+    Returns, per row, the column assigned to it so that the total cost is
+    minimal. Runs in O(rows^2 * columns).
+    """
+    n, m = len(cost), len(cost[0]) if cost else 0
+    INF = float('inf')
+    u, v = [0] * (n + 1), [0] * (m + 1)
+    match, way = [0] * (m + 1), [0] * (m + 1)   # column -> row (1-based), augmenting path
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = cost[i0 - 1]
+            u_i0 = u[i0]
+            delta, j1 = INF, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u_i0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    assignment = [-1] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            assignment[match[j] - 1] = j - 1
+    return assignment
+
+def plan_substitutes(snapshot, weekday, absent_teachers, history_loads=None, taken=None, covered=(), unavailable=()):
+    """Propose substitutes for every lesson the absent teachers have on a weekday.
+
+    Each period is solved as a min-cost matching between its uncovered
+    lessons and the teachers free in that period (not timetabled, not
+    absent, not already substituting). Costs favour teachers of the same
+    subject and teachers who know the class, and penalise substitutions
+    already given that day and, more lightly, in the past, so cover is
+    spread out. A teacher is never given two lessons in one period.
+
+    history_loads maps teacher names to past substitution counts, taken maps
+    period keys to teacher names already substituting, and covered holds
+    (period key, absent teacher, lowercased class) lessons that already have
+    cover. unavailable names teachers who must not cover but whose lessons
+    are not planned for, such as those already recorded absent that day.
+    Returns (assignments, unassigned, already_covered) lists of lesson dicts.
+    """
+    occupancy = snapshot.occupancy
+    history_loads = history_loads or {}
+    taken = taken or {}
+    subject_cost = app.config['SUBSTITUTE_SUBJECT_MISMATCH_COST']
+    class_cost = app.config['SUBSTITUTE_UNFAMILIAR_CLASS_COST']
+    daily_cost = app.config['SUBSTITUTE_DAILY_LOAD_COST']
+    history_cost = app.config['SUBSTITUTE_HISTORY_LOAD_COST']
+    history_cap = app.config['SUBSTITUTE_HISTORY_LOAD_CAP']
+
+    absent = set(absent_teachers)
+    absent_mask = 0
+    for name in absent | set(unavailable):
+        tid = occupancy.teacher_ids.get(name)
+        if tid is not None:
+            absent_mask |= 1 << tid
+
+    # The absent teachers' lessons that day, grouped by period
+    lessons_by_period = {}
+    seen = set()
+    already_covered = []
+    for i in range(len(snapshot)):
+        teacher = snapshot.teacher[i]
+        if teacher not in absent or snapshot.weekday[i] != weekday or not snapshot.period_key[i]:
+            continue
+        period_key, class_activity = snapshot.period_key[i], snapshot.class_activity[i]
+        key = (period_key, teacher, class_activity)
+        if key in seen:
+            continue
+        seen.add(key)
+        lesson = {
+            'period': period_value(period_key),
+            'original_teacher': teacher,
+            'class_activity': class_activity,
+            'subject': clean_subject_name(snapshot.subject[i]),
+            'time_slot': snapshot.time_slot[i]
+        }
+        if (period_key, teacher, class_activity.lower()) in covered or (period_key, teacher, '') in covered:
+            already_covered.append(lesson)
+        else:
+            lessons_by_period.setdefault(period_key, []).append(lesson)
+
+    daily_loads = {}
+    assignments, unassigned = [], []
+    for period_key in sorted(lessons_by_period, key=_period_sort_key):
+        lessons = lessons_by_period[period_key]
+        taken_mask = 0
+        for name in taken.get(period_key, ()):
+            tid = occupancy.teacher_ids.get(name)
+            if tid is not None:
+                taken_mask |= 1 << tid
+        free = list(iter_bits(occupancy.all_teachers & ~occupancy.busy_mask(weekday, period_key)
+                              & ~absent_mask & ~taken_mask))
+        if not free:
+            unassigned.extend(lessons)
+            continue
+
+        cost = []
+        for lesson in lessons:
+            subject_lower = lesson['subject'].lower()
+            class_mask = occupancy.class_teachers.get(lesson['class_activity'].lower(), 0)
+            row = []
+            for tid in free:
+                name = occupancy.teachers[tid]
+                c = daily_cost * daily_loads.get(name, 0)
+                c += history_cost * min(history_loads.get(name, 0), history_cap)
+                if not any(subject_lower == lower for _, lower in occupancy.teacher_subjects[tid]):
+                    c += subject_cost
+                if not class_mask >> tid & 1:
+                    c += class_cost
+                row.append(c)
+            cost.append(row)
+
+        if len(lessons) > len(free):
+            # More lessons than free teachers: match each teacher to a lesson
+            # on the transposed matrix; the lessons left over stay unassigned
+            transposed = [list(column) for column in zip(*cost)]
+            pairs = sorted((r, column) for column, r in enumerate(min_cost_assignment(transposed)))
+            chosen = {r for r, _ in pairs}
+            unassigned.extend(lessons[r] for r in range(len(lessons)) if r not in chosen)
+        else:
+            pairs = list(enumerate(min_cost_assignment(cost)))
+        for r, column in pairs:
+            lesson, tid = lessons[r], free[column]
+            name = occupancy.teachers[tid]
+            subject_lower = lesson['subject'].lower()
+            subjects = occupancy.teacher_subjects[tid]
+            matching = [subject for subject, lower in subjects if lower == subject_lower]
+            assignments.append(dict(
+                lesson,
+                substitute_teacher=name,
+                substitute_subject=matching[0] if matching else (subjects[0][0] if subjects else ''),
+                subject_match=bool(matching),
+                knows_class=bool(occupancy.class_teachers.get(lesson['class_activity'].lower(), 0) >> tid & 1),
+                cost=cost[r][column]
+            ))
+            daily_loads[name] = daily_loads.get(name, 0) + 1
+    return assignments, unassigned, already_covered
+
+@app.route('/api/substitutions/plan', methods=['POST'])
+def plan_substitutions():
+    """Propose substitutes for a whole day of absences.
+
+    Body: {"date": "YYYY-MM-DD", "absent_teachers": [...]}. Nothing is
+    saved; the assignments can be sent to /api/substitutions/bulk as they are.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        plan_date = datetime.strptime(str(data.get('date', '')), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Invalid date. Use YYYY-MM-DD'}), 400
+    absent_teachers = data.get('absent_teachers')
+    if isinstance(absent_teachers, str):
+        absent_teachers = [absent_teachers]
+    if not absent_teachers:
+        return jsonify({'error': 'absent_teachers is required'}), 400
+    if not isinstance(absent_teachers, list) or not all(isinstance(name, str) for name in absent_teachers):
+        return jsonify({'error': 'absent_teachers must be a list of teacher names'}), 400
+
+    snapshot = timetable_snapshot
+    names = {teacher_key(name): name for name in snapshot.teachers}
+    unknown = [name for name in absent_teachers if teacher_key(name) not in names]
+    if unknown:
+        return jsonify({'error': f"Unknown teachers: {', '.join(unknown)}"}), 400
+    absent = [names[teacher_key(name)] for name in absent_teachers]
+
+    # Existing cover and recorded absences that day, and everyone's past substitution counts
+    taken, covered, recorded_absent = {}, set(), set()
+    for sub in Substitution.query.filter(Substitution.date == plan_date):
+        period_key = str(sub.period)
+        recorded_absent.add(names.get(teacher_key(sub.original_teacher), sub.original_teacher))
+        taken.setdefault(period_key, set()).add(names.get(teacher_key(sub.substitute_teacher), sub.substitute_teacher))
+        covered.add((period_key, names.get(teacher_key(sub.original_teacher), sub.original_teacher),
+                     sub.class_activity.lower()))
+    history_loads = {}
+    for stats in TeacherSubstitutionStats.query.filter(TeacherSubstitutionStats.substitute > 0):
+        if stats.teacher_key in names:
+            history_loads[names[stats.teacher_key]] = stats.substitute
+
+    assignments, unassigned, already_covered = plan_substitutes(
+        snapshot, plan_date.weekday(), absent, history_loads, taken, covered, recorded_absent
+    )
+    for lesson in assignments + unassigned + already_covered:
+        lesson['date'] = plan_date.isoformat()
+    return jsonify({
+        'date': plan_date.isoformat(),
+        'assignments': assignments,
+        'unassigned': unassigned,
+        'already_covered': already_covered
+    })
+
+@app.route('/api/substitutions/bulk', methods=['POST'])
+def save_substitutions_bulk():
+    """Validate and save a batch of substitutions in one transaction.
+
+    Accepts {"substitutions": [...], "atomic": false} or a bare list. Valid
+    items are saved and invalid ones reported; with atomic, nothing is saved
+    unless every item is valid. Returns one result per item, in order.
+    """
+    data = request.get_json(silent=True)
+    atomic = False
+    if isinstance(data, dict):
+        atomic = bool(data.get('atomic', False))
+        data = data.get('substitutions')
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Expected a non-empty list of substitutions'}), 400
+
+    validated = validate_substitutions(data)
+    valid = [s for s in validated if isinstance(s, Substitution)]
+    rejected = len(validated) - len(valid)
+    save = valid and not (atomic and rejected)
+    if save:
+        try:
+            db.session.add_all(valid)
+            record_substitution_stats((s.original_teacher, s.substitute_teacher) for s in valid)
+            bump_substitution_version()
+            db.session.commit()
+        except db.exc.IntegrityError:
+            # Another request booked one of these substitutes between validation and commit
+            db.session.rollback()
+            return jsonify({'error': 'A substitute was booked by another request at the same time; nothing was saved, please retry'}), 409
+        invalidate_substitution_events()
+
+    results = []
+    for index, s in enumerate(validated):
+        if not isinstance(s, Substitution):
+            results.append({'index': index, 'status': 'rejected', 'errors': s})
+        elif save:
+            results.append({'index': index, 'status': 'created', 'id': s.id})
+        else:
+            results.append({'index': index, 'status': 'not_saved', 'errors': []})
+    created = len(valid) if save else 0
+    return jsonify({'created': created, 'rejected': rejected, 'results': results}), 201 if created else 400
+
+def substitution_cursor(substitution):
+    """Keyset pagination token for the position just after a substitution"""
+    return f"{substitution.date.isoformat()}_{substitution.period}_{substitution.id}"
+
 @app.route('/api/substitutions', methods=['GET'])
 def get_substitutions():
-    substitutions = Substitution.query.all()
-    result = [
-        {
-            'id': s.id,
-            'date': s.date,
-            'period': s.period,
-            'class_activity': s.class_activity,
-            'original_teacher': s.original_teacher,
-            'substitute_teacher': s.substitute_teacher,
-            'subject': s.subject
-        }
-        for s in substitutions
-    ]
-    return jsonify(result)
+    """Substitutions ordered by (date, period, id), filtered and paginated by keyset.
+
+    Query params: start/end (YYYY-MM-DD, inclusive), teacher (original or
+    substitute), class, limit (default 100, max 1000) and after (the 'next'
+    token of the previous page).
+    """
+    query = Substitution.query
+    try:
+        if request.args.get('start'):
+            query = query.filter(Substitution.date >= datetime.strptime(request.args['start'], '%Y-%m-%d').date())
+        if request.args.get('end'):
+            query = query.filter(Substitution.date <= datetime.strptime(request.args['end'], '%Y-%m-%d').date())
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        if request.args.get('after'):
+            after_date, after_period, after_id = request.args['after'].split('_')
+            query = query.filter(db.tuple_(Substitution.date, Substitution.period, Substitution.id) >
+                                 (datetime.strptime(after_date, '%Y-%m-%d').date(), int(after_period), int(after_id)))
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end, limit or after parameter'}), 400
+
+    teacher = request.args.get('teacher', '').strip()
+    if teacher:
+        query = query.filter(db.or_(Substitution.original_teacher == teacher,
+                                    Substitution.substitute_teacher == teacher))
+    class_filter = request.args.get('class', '').strip()
+    if class_filter:
+        query = query.filter(Substitution.class_activity == class_filter)
+
+    # Fetch one extra row to know whether there is a next page
+    substitutions = query.order_by(Substitution.date, Substitution.period, Substitution.id).limit(limit + 1).all()
+    has_more = len(substitutions) > limit
+    substitutions = substitutions[:limit]
+    return jsonify({
+        'substitutions': [s.to_dict() for s in substitutions],
+        'next': substitution_cursor(substitutions[-1]) if has_more else None
+    })
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+
+from app import CompiledTimetable, plan_substitutes
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+SUBJECTS = ["Maths", "Physics", "Chemistry", "Biology", "English", "Hindi", "History",
+            "Geography", "Computer Science", "Economics", "Art", "Physical Education"]
+
+def build_school(teachers, periods, lessons_per_day, seed):
+    """Synthetic timetable: every teacher has one subject and lessons_per_day lessons a day"""
+    rng = random.Random(seed)
+    classes = [f"{grade}{section}" for grade in range(6, 13) for section in "ABCDEFGH"]
+    records = []
+    for t in range(teachers):
+        teacher = f"Teacher {t:03d}"
+        subject = SUBJECTS[t % len(SUBJECTS)]
+        taught = rng.sample(classes, 6)
+        for day in DAYS:
+            for period in rng.sample(range(1, periods + 1), lessons_per_day):
+                start = 9 * 60 + (period - 1) * 45
+                records.append({
+                    "Teacher Name": teacher,
+                    "Subject": subject,
+                    "Day": day,
+                    "Period": period,
+                    "Time Slot": f"{start // 60:02d}:{start % 60:02d} to {(start + 40) // 60:02d}:{(start + 40) % 60:02d}",
+                    "Class/Activity": rng.choice(taught)
+                })
+    return CompiledTimetable.from_records(records), rng
+
+def check_plan(assignments):
+    """No substitute may be given two lessons in the same period"""
+    slots = set()
+    for assignment in assignments:
+        slot = (assignment["period"], assignment["substitute_teacher"])
+        assert slot not in slots, f"double-booked: {slot}"
+        slots.add(slot)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark whole-day substitute planning.')
+    parser.add_argument('--teachers', type=int, default=300)
+    parser.add_argument('--periods', type=int, default=8)
+    parser.add_argument('--lessons-per-day', type=int, default=6)
+    parser.add_argument('--absent', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snapshot, rng = build_school(args.teachers, args.periods, args.lessons_per_day, args.seed)
+    print(f"Built {len(snapshot)} lessons for {len(snapshot.teachers)} teachers "
+          f"in {time.perf_counter() - started:.2f}s")
+    history_loads = {teacher: rng.randint(0, 40) for teacher in snapshot.teachers}
+
+    for absent_count in args.absent:
+        timings = []
+        for run in range(args.runs):
+            absent = rng.sample(snapshot.teachers, absent_count)
+            weekday = rng.randrange(len(DAYS))
+            started = time.perf_counter()
+            assignments, unassigned, _ = plan_substitutes(snapshot, weekday, absent, history_loads)
+            timings.append(time.perf_counter() - started)
+            check_plan(assignments)
+        timings.sort()
+        matched = sum(a["subject_match"] for a in assignments)
+        print(f"{absent_count:3d} absent: median {timings[len(timings) // 2] * 1000:7.1f} ms, "
+              f"max {timings[-1] * 1000:7.1f} ms over {args.runs} runs "
+              f"(last plan: {len(assignments)} covered, {matched} same subject, {len(unassigned)} unassigned)")
+
+if __name__ == "__main__":
+    main()
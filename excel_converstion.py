@@ -2,6 +2,8 @@ import pandas as pd
 import os
 import argparse
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 def process_timetable(df):
     """
@@ -123,90 +125,157 @@ def is_teachers_list(df):
     sample = str(df.iloc[0:10].values)
     return "TEACHER" in sample and ("S.NO" in sample or "SL NO" in sample)
 
-def convert_excel_to_csv(input_file, output_dir):
-    """Convert Excel file to CSV, processing different types of sheets appropriately."""
+def read_workbook(input_file):
+    """Open a workbook once and parse all of its sheets; returns ({sheet name: DataFrame}, seconds)."""
+    started = time.perf_counter()
+    with pd.ExcelFile(input_file) as excel_file:
+        sheets = excel_file.parse(sheet_name=excel_file.sheet_names)
+    return sheets, time.perf_counter() - started
+
+def convert_sheet(base_name, sheet_name, df, output_dir):
+    """Classify and process one parsed sheet and save it as CSV.
+
+    Returns (result, message, seconds); result is None for sheets that were
+    skipped or failed. Runs in a worker process, so it only uses its arguments.
+    """
+    started = time.perf_counter()
+    result = None
+    try:
+        # Skip empty sheets
+        if df.empty or df.isna().all().all():
+            return None, f"Skipping empty sheet: {sheet_name}", time.perf_counter() - started
+        
+        # Clean the dataframe
+        df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
+        
+        # Determine the type of sheet
+        sheet_type = "unknown"
+        processed_df = df
+        
+        if is_timetable_sheet(df):
+            sheet_type = "timetable"
+            timetable_data = process_timetable(df)
+            
+            if timetable_data["timetable"] is not None:
+                processed_df = timetable_data["timetable"]
+            
+            result = {
+                "sheet": sheet_name,
+                "type": "timetable",
+                "teacher": timetable_data["teacher_name"],
+                "subject": timetable_data["subject"]
+            }
+            
+        elif is_teachers_list(df):
+            sheet_type = "teachers_list"
+            processed_df = extract_teachers_list(df)
+            result = {
+                "sheet": sheet_name,
+                "type": "teachers_list",
+                "count": len(processed_df)
+            }
+        
+        # Generate output CSV filename
+        csv_filename = f"{base_name}_{sheet_name}_{sheet_type}.csv"
+        output_path = os.path.join(output_dir, csv_filename)
+        
+        # Save to CSV
+        processed_df.to_csv(output_path, index=False)
+        message = f"Converted sheet '{sheet_name}' to {csv_filename} as {sheet_type}"
+        
+    except Exception as e:
+        result = None
+        message = f"Error processing sheet '{sheet_name}': {str(e)}"
+    
+    return result, message, time.perf_counter() - started
+
+def _base_name(input_file):
+    # Get the base filename without extension
+    return os.path.basename(input_file).split('.')[0]
+
+def convert_excel_to_csv(input_file, output_dir, executor=None, timings=None):
+    """Convert Excel file to CSV, processing different types of sheets appropriately.
+
+    The workbook is read once; sheets are processed on executor when given.
+    Per-sheet (file, sheet, seconds) timings are appended to timings.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Get the base filename without extension
-    base_name = os.path.basename(input_file).split('.')[0]
+    sheets, read_seconds = read_workbook(input_file)
+    return _convert_sheets(input_file, sheets, read_seconds, output_dir, executor, timings)
+
+def _convert_sheets(input_file, sheets, read_seconds, output_dir, executor=None, timings=None):
+    base_name = _base_name(input_file)
+    if timings is not None:
+        timings.append((input_file, "(read workbook)", read_seconds))
     
-    # Read the Excel file
-    excel_file = pd.ExcelFile(input_file)
+    if executor is None:
+        outcomes = [convert_sheet(base_name, name, df, output_dir) for name, df in sheets.items()]
+    else:
+        futures = [executor.submit(convert_sheet, base_name, name, df, output_dir) for name, df in sheets.items()]
+        outcomes = [future.result() for future in futures]
     
+    # Report in sheet order regardless of which worker finished first
     results = []
-    
-    # Process each sheet
-    for sheet_name in excel_file.sheet_names:
-        try:
-            # Read the sheet
-            df = pd.read_excel(input_file, sheet_name=sheet_name)
-            
-            # Skip empty sheets
-            if df.empty or df.isna().all().all():
-                print(f"Skipping empty sheet: {sheet_name}")
-                continue
-            
-            # Clean the dataframe
-            df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
-            
-            # Determine the type of sheet
-            sheet_type = "unknown"
-            processed_df = df
-            
-            if is_timetable_sheet(df):
-                sheet_type = "timetable"
-                timetable_data = process_timetable(df)
-                
-                if timetable_data["timetable"] is not None:
-                    processed_df = timetable_data["timetable"]
-                
-                results.append({
-                    "sheet": sheet_name,
-                    "type": "timetable",
-                    "teacher": timetable_data["teacher_name"],
-                    "subject": timetable_data["subject"]
-                })
-                
-            elif is_teachers_list(df):
-                sheet_type = "teachers_list"
-                processed_df = extract_teachers_list(df)
-                results.append({
-                    "sheet": sheet_name,
-                    "type": "teachers_list",
-                    "count": len(processed_df)
-                })
-            
-            # Generate output CSV filename
-            csv_filename = f"{base_name}_{sheet_name}_{sheet_type}.csv"
-            output_path = os.path.join(output_dir, csv_filename)
-            
-            # Save to CSV
-            processed_df.to_csv(output_path, index=False)
-            print(f"Converted sheet '{sheet_name}' to {csv_filename} as {sheet_type}")
-            
-        except Exception as e:
-            print(f"Error processing sheet '{sheet_name}': {str(e)}")
+    for sheet_name, (result, message, seconds) in zip(sheets, outcomes):
+        print(message)
+        if result is not None:
+            results.append(result)
+        if timings is not None:
+            timings.append((input_file, sheet_name, seconds))
     
     return results
 
+def print_timing_summary(timings, wall_seconds, jobs):
+    """Print per-sheet processing times, slowest first."""
+    print(f"\nTiming summary ({jobs} job{'s' if jobs != 1 else ''}, {wall_seconds:.2f}s wall clock):")
+    for input_file, sheet_name, seconds in sorted(timings, key=lambda t: t[2], reverse=True):
+        print(f"  {seconds:8.3f}s  {os.path.basename(input_file)} / {sheet_name}")
+    print(f"  {sum(t[2] for t in timings):8.3f}s  total worker time")
+
 def main():
     parser = argparse.ArgumentParser(description='Convert Excel files with teacher timetables to CSV format.')
     parser.add_argument('input_files', nargs='+', help='Input Excel files to convert')
     parser.add_argument('--output_dir', default='csv_output', help='Output directory for CSV files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for reading workbooks and processing sheets (default: CPU count)')
     
     args = parser.parse_args()
+    jobs = max(1, args.jobs)
     
-    all_results = []
-    
+    input_files = []
     for input_file in args.input_files:
         if not os.path.exists(input_file):
             print(f"Error: File {input_file} does not exist.")
             continue
-            
-        print(f"\nProcessing: {input_file}")
-        results = convert_excel_to_csv(input_file, args.output_dir)
-        all_results.extend(results)
+        input_files.append(input_file)
+    
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    
+    all_results = []
+    timings = []
+    started = time.perf_counter()
+    
+    if jobs == 1:
+        for input_file in input_files:
+            print(f"\nProcessing: {input_file}")
+            all_results.extend(convert_excel_to_csv(input_file, args.output_dir, timings=timings))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Workbooks are read in parallel (each one opened once), then their
+            # sheets are fanned out across the same pool
+            reads = [executor.submit(read_workbook, input_file) for input_file in input_files]
+            for input_file, read in zip(input_files, reads):
+                print(f"\nProcessing: {input_file}")
+                try:
+                    sheets, read_seconds = read.result()
+                except Exception as e:
+                    print(f"Error reading {input_file}: {str(e)}")
+                    continue
+                all_results.extend(_convert_sheets(input_file, sheets, read_seconds, args.output_dir,
+                                                   executor, timings))
         
     print("\nSummary of processed sheets:")
     
@@ -222,6 +291,8 @@ def main():
         for tl in teacher_lists:
             print(f"  Sheet: {tl['sheet']}, Teachers Count: {tl.get('count', 'Unknown')}")
     
+    print_timing_summary(timings, time.perf_counter() - started, jobs)
+    
     print(f"\nAll CSV files have been saved to: {os.path.abspath(args.output_dir)}")
 
 if __name__ == "__main__":
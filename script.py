@@ -1,101 +1,196 @@
 import os
+import io
 import csv
 import glob
+import json
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 def clean_text(text):
     return text.strip().replace(',', '') if text else ''
 
+DAY_ORDER = ["Mon", "Tue", "Wed", "Thurs", "Fri", "Sat"]
+
 def parse_timetables(raw_text):
-    lines = [line.strip() for line in raw_text.strip().split('\n') if line.strip()]
-    
-    teacher_blocks = []
-    current_block = []
-    for line in lines:
-        if line.startswith("Name of the Teacher:"):
-            if current_block:
-                teacher_blocks.append(current_block)
-                current_block = []
-        current_block.append(line)
-    if current_block:
-        teacher_blocks.append(current_block)
-    
+    rows = (line.split(',') for line in raw_text.strip().split('\n'))
+    return parse_timetable_rows(rows)
+
+def parse_timetable_rows(rows):
+    """Parse teacher timetable blocks from rows of cells (lists of values).
+
+    Rows can come from csv.reader or straight from a workbook sheet, so no
+    text round trip is needed. Blank rows are skipped; a row whose first
+    cell starts with "Name of the Teacher:" begins a new teacher block.
+    """
     results = []
-    for block in teacher_blocks:
-        teacher_name = 'UNKNOWN'
-        subject = ''
-        periods = []
-        timings = []
-        day_rows = []
-        day_order = ["Mon", "Tue", "Wed", "Thurs", "Fri", "Sat"]
+    block = None
+    for row in rows:
+        cells = ['' if cell is None else str(cell).strip() for cell in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        if not cells:
+            continue
+        first = cells[0]
+        if first.startswith("Name of the Teacher:"):
+            if block:
+                results.extend(_block_rows(block))
+            block = {'teacher_name': _labelled_value(cells, 0) or 'UNKNOWN', 'subject': '', 'timings': [], 'day_rows': []}
+        elif block is None:
+            block = {'teacher_name': 'UNKNOWN', 'subject': '', 'timings': [], 'day_rows': []}
         
-        i = 0
-        while i < len(block):
-            line = block[i]
-
-            if line.startswith("Name of the Teacher:"):
-                teacher_name = clean_text(line.split(':',1)[1]) if ':' in line else 'UNKNOWN'
-            elif line.startswith("Subject"):
-                subject = clean_text(line.split(':',1)[1]) if ':' in line else ''
-            elif line.startswith("Periods"):
-                periods = [p for p in line.split(',') if p.strip().isdigit()]
-            elif line.startswith("Timings"):
-                timings = [t.strip() for t in line.split(',')[1:]]
-            elif any(line.startswith(day) for day in day_order):
-                while i < len(block) and any(block[i].startswith(day) for day in day_order):
-                    day_rows.append(block[i])
-                    i += 1
-                continue
-            i += 1
-        
-        for day_line in day_rows:
-            parts = day_line.split(',')
-            day = parts[0].strip()
-            if day not in day_order:
+        if first.startswith("Timings"):
+            block['timings'] = cells[1:]
+        elif any(first.startswith(day) for day in DAY_ORDER):
+            block['day_rows'].append(cells)
+        else:
+            # The subject may share a row with the teacher name
+            for i, cell in enumerate(cells):
+                if cell.startswith("Subject"):
+                    block['subject'] = _labelled_value(cells, i) if ':' in cell else ''
+                    break
+    if block:
+        results.extend(_block_rows(block))
+    return results
+
+def _labelled_value(cells, i):
+    """Text after the colon in cells[i], or the next non-empty cell if that is blank"""
+    value = clean_text(cells[i].split(':', 1)[1])
+    if not value:
+        for cell in cells[i + 1:]:
+            if cell and not cell.startswith("Subject"):
+                return clean_text(cell)
+    return value
+
+def _block_rows(block):
+    results = []
+    timings = block['timings']
+    for cells in block['day_rows']:
+        day = cells[0]
+        if day not in DAY_ORDER:
+            continue
+        for idx, cell in enumerate(cells[1:]):
+            if not cell or cell.startswith('*'):
                 continue
-            for idx, cell in enumerate(parts[1:]):
-                cell = cell.strip()
-                if not cell or cell.startswith('*'):
-                    continue
-                period = idx
-                time_slot = timings[idx] if idx < len(timings) else ''
-                results.append({
-                    "Teacher Name": teacher_name,
-                    "Subject": subject,
-                    "Day": day,
-                    "Period": period,
-                    "Time Slot": time_slot,
-                    "Class/Activity": cell
-                })
+            period = idx
+            time_slot = timings[idx] if idx < len(timings) else ''
+            results.append({
+                "Teacher Name": block['teacher_name'],
+                "Subject": block['subject'],
+                "Day": day,
+                "Period": period,
+                "Time Slot": time_slot,
+                "Class/Activity": cell
+            })
     return results
 
-def save_to_csv_append(data, filename):
-    file_exists = os.path.isfile(filename)
-    with open(filename, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=["Teacher Name", "Subject", "Day", "Period", "Time Slot", "Class/Activity"])
-        if not file_exists:
-            writer.writeheader()
-        writer.writerows(data)
+FIELDNAMES = ["Teacher Name", "Subject", "Day", "Period", "Time Slot", "Class/Activity"]
+
+def save_to_csv_atomic(rows, filename):
+    """Write rows (lists in FIELDNAMES order) to filename via a temp file and rename,
+    so readers never see a half-written timetable."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.csv', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDNAMES)
+            writer.writerows(rows)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 def parse_csv_file(filepath):
-    with open(filepath, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        raw_lines = [','.join(row) for row in reader]
-        return '\n'.join(raw_lines)
+    """Parse one teacher CSV; returns (sha1 of its bytes, rows in FIELDNAMES order)"""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+    rows = [[entry[field] for field in FIELDNAMES] for entry in parse_timetable_rows(reader)]
+    return hashlib.sha1(data).hexdigest(), rows
+
+def _file_sha1(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(manifest_file):
+    """Manifest of processed files: {file name: {size, mtime_ns, sha1, rows}}"""
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('files', {})
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(files, manifest_file):
+    directory = os.path.dirname(os.path.abspath(manifest_file))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f)
+    os.replace(tmp_path, manifest_file)
+
+def process_all_csvs_in_folder(folder_path, output_file='final_timetable.csv', jobs=None, full=False):
+    """Rebuild output_file from the teacher CSVs in folder_path.
 
-def process_all_csvs_in_folder(folder_path, output_file='final_timetable.csv'):
-    csv_files = glob.glob(os.path.join(folder_path, '*.csv'))
+    A manifest next to the output records each file's size, mtime, hash and
+    parsed rows. Only new or changed files are parsed (in parallel across
+    jobs processes); unchanged files reuse their rows from the manifest and
+    deleted files drop out. The output holds each source file's rows once
+    and is replaced atomically. full ignores the manifest.
+    """
+    manifest_file = output_file + '.manifest.json'
+    previous = {} if full else load_manifest(manifest_file)
+    csv_files = sorted(glob.glob(os.path.join(folder_path, '*.csv')))
     print(f"📄 Found {len(csv_files)} CSV files in {folder_path}")
     
+    files = {}
+    to_parse = []
     for file in csv_files:
-        print(f"🔍 Processing: {os.path.basename(file)}")
-        raw_data = parse_csv_file(file)
-        parsed_data = parse_timetables(raw_data)
-        save_to_csv_append(parsed_data, output_file)
-        print(f"✅ Added {len(parsed_data)} entries from {os.path.basename(file)}")
-
-    print(f"\n🎉 All done! Final timetable saved to: {output_file}")
+        name = os.path.basename(file)
+        stat = os.stat(file)
+        entry = previous.get(name)
+        if entry and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            files[name] = entry
+        elif entry and entry['size'] == stat.st_size and entry['sha1'] == _file_sha1(file):
+            # Touched but not modified
+            files[name] = dict(entry, mtime_ns=stat.st_mtime_ns)
+        else:
+            files[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            to_parse.append(file)
+    
+    if to_parse:
+        jobs = min(jobs or os.cpu_count() or 1, len(to_parse))
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                parsed = list(executor.map(parse_csv_file, to_parse))
+        else:
+            parsed = [parse_csv_file(file) for file in to_parse]
+        for file, (sha1, rows) in zip(to_parse, parsed):
+            name = os.path.basename(file)
+            files[name].update(sha1=sha1, rows=rows)
+            print(f"🔍 Processed {name}: {len(rows)} entries")
+    
+    removed = sorted(set(previous) - set(files))
+    for name in removed:
+        print(f"🗑️ Dropped {len(previous[name]['rows'])} entries from deleted file {name}")
+    
+    if to_parse or removed or full or not os.path.exists(output_file):
+        save_to_csv_atomic((row for name in sorted(files) for row in files[name]['rows']), output_file)
+    save_manifest(files, manifest_file)
+    
+    total = sum(len(entry['rows']) for entry in files.values())
+    print(f"✅ {len(to_parse)} new or changed, {len(files) - len(to_parse)} unchanged, {len(removed)} removed")
+    print(f"\n🎉 All done! Final timetable saved to: {output_file} ({total} entries)")
 
 # === Run ===
 if __name__ == "__main__":
-    folder_with_csvs = "csv_files"  # Replace with your folder path
-    process_all_csvs_in_folder(folder_with_csvs)
+    parser = argparse.ArgumentParser(description='Combine teacher timetable CSVs into a single timetable CSV.')
+    parser.add_argument('folder', nargs='?', default='csv_files', help='Folder with teacher timetable CSVs')
+    parser.add_argument('--output', default='final_timetable.csv', help='Combined timetable CSV to write')
+    parser.add_argument('--jobs', type=int, default=None, help='Worker processes for parsing (default: CPU count)')
+    parser.add_argument('--full', action='store_true', help='Ignore the manifest and reprocess every file')
+    args = parser.parse_args()
+    process_all_csvs_in_folder(args.folder, args.output, jobs=args.jobs, full=args.full)